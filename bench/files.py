@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+BLOCK_SIZE = 1024 * 1024  # Блок записи крупных и растущих файлов
+
+
+@dataclass
+class BenchFile:
+    name: str
+    kind: str  # small, large или growing
+    size: int  # Итоговый размер файла (байт)
+    appeared_at: float | None = None  # Время окончания записи: с него считается задержка до MinIO
+
+
+class FileMix:
+    """Набор файлов бенчмарка в директории, которую отдает SFTP-сервер.
+
+    Мелкие файлы появляются сразу, крупные пишутся параллельно блоками,
+    растущие дописываются каждые grow_interval секунд grow_steps раз —
+    сканер должен дождаться их стабилизации.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        small_count: int,
+        small_size: int,
+        large_count: int,
+        large_size: int,
+        growing_count: int,
+        growing_size: int,
+        grow_steps: int,
+        grow_interval: float,
+    ):
+        self.directory = directory
+        self.grow_steps = max(1, grow_steps)
+        self.grow_interval = grow_interval
+        self.files = (
+            [BenchFile(f"small_{i:06d}.bin", "small", small_size) for i in range(small_count)]
+            + [BenchFile(f"large_{i:03d}.bin", "large", large_size) for i in range(large_count)]
+            + [
+                BenchFile(f"growing_{i:03d}.bin", "growing", growing_size)
+                for i in range(growing_count)
+            ]
+        )
+        # Один случайный блок на весь прогон: генерация не должна быть узким местом
+        self._block = os.urandom(BLOCK_SIZE)
+        self._threads = []
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(file.size for file in self.files)
+
+    def _header(self, file: BenchFile) -> bytes:
+        # Уникальное начало, чтобы файлы не совпадали по содержимому
+        return f"{file.name}:{time.time_ns()}\n".encode()
+
+    def _write(self, file: BenchFile, path: str, size: int, mode: str = "wb") -> None:
+        with open(path, mode) as f:
+            remaining = size
+            if mode == "wb":
+                header = self._header(file)[:size]
+                f.write(header)
+                remaining -= len(header)
+            while remaining > 0:
+                chunk = self._block[: min(BLOCK_SIZE, remaining)]
+                f.write(chunk)
+                remaining -= len(chunk)
+
+    def _write_small(self) -> None:
+        for file in self.files:
+            if file.kind == "small":
+                path = os.path.join(self.directory, file.name)
+                with open(path, "wb") as f:
+                    header = self._header(file)[: file.size]
+                    f.write(header + os.urandom(file.size - len(header)))
+                file.appeared_at = time.time()
+
+    def _write_large(self, file: BenchFile) -> None:
+        self._write(file, os.path.join(self.directory, file.name), file.size)
+        file.appeared_at = time.time()
+
+    def _grow(self, files: list) -> None:
+        step = [file.size // self.grow_steps for file in files]
+        for number in range(self.grow_steps):
+            for file, size in zip(files, step):
+                if number == self.grow_steps - 1:
+                    size = file.size - size * (self.grow_steps - 1)
+                path = os.path.join(self.directory, file.name)
+                self._write(file, path, size, "wb" if number == 0 else "ab")
+                if number == self.grow_steps - 1:
+                    file.appeared_at = time.time()
+            if number < self.grow_steps - 1:
+                time.sleep(self.grow_interval)
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        growing = [file for file in self.files if file.kind == "growing"]
+        targets = [(self._write_small, ())]
+        targets += [(self._write_large, (file,)) for file in self.files if file.kind == "large"]
+        if growing:
+            targets.append((self._grow, (growing,)))
+        for target, args in targets:
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wait(self) -> None:
+        for thread in self._threads:
+            thread.join()
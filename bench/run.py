@@ -0,0 +1,355 @@
+"""Сквозной бенчмарк конвейера: сканирование → скачивание → загрузка в MinIO.
+
+Запуск из корня проекта:
+
+    python -m bench.run --small 2000 --large 2 --large-size 1G --output results.json
+
+SFTP-сервер и S3-стенд работают в процессе бенчмарка, воркеры Celery —
+отдельными процессами с настройками, переданными через переменные окружения.
+Без --redis-url поднимается fakeredis по TCP (нужен пакет fakeredis);
+база --redis-url очищается перед прогоном.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlparse
+
+from loguru import logger
+
+from .files import FileMix
+from .s3_server import LocalS3Server
+from .sftp_server import LocalSFTPServer
+
+ROOT = Path(__file__).resolve().parent.parent
+REMOTE_PATH = "/incoming"
+LANES = ("small", "medium", "large")
+RSS_SAMPLE_INTERVAL = 0.5
+WORKER_START_TIMEOUT = 60
+WORKER_STOP_TIMEOUT = 30
+
+
+def parse_size(value: str) -> int:
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк FileManager")
+    parser.add_argument("--small", type=int, default=1000, help="Количество мелких файлов")
+    parser.add_argument("--small-size", type=parse_size, default="64K", help="Размер мелкого файла")
+    parser.add_argument("--large", type=int, default=1, help="Количество крупных файлов")
+    parser.add_argument("--large-size", type=parse_size, default="512M", help="Размер крупного файла")
+    parser.add_argument("--growing", type=int, default=5, help="Количество растущих файлов")
+    parser.add_argument("--growing-size", type=parse_size, default="32M", help="Итоговый размер растущего файла")
+    parser.add_argument("--grow-steps", type=int, default=5, help="Сколько раз дописывается растущий файл")
+    parser.add_argument("--grow-interval", type=float, default=2.0, help="Пауза (сек) между дозаписями")
+    parser.add_argument("--scan-interval", type=float, default=2.0, help="Интервал (сек) запуска scan_all_servers")
+    parser.add_argument("--quiet-period", type=int, default=5, help="STABLE_QUIET_PERIOD (сек) на время прогона")
+    parser.add_argument("--download-concurrency", type=int, default=8)
+    parser.add_argument("--upload-concurrency", type=int, default=8)
+    parser.add_argument("--pool", default="prefork", help="Пул воркеров Celery: prefork или threads")
+    parser.add_argument("--timeout", type=float, default=1800, help="Максимальная длительность (сек) прогона")
+    parser.add_argument("--redis-url", help="Отдельная база Redis для прогона, например redis://localhost:6379/15")
+    parser.add_argument("--db-url", help="URL БД; по умолчанию SQLite в рабочей директории")
+    parser.add_argument("--workdir", help="Рабочая директория; по умолчанию временная")
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Дополнительная настройка из src/config.py, например STREAM_TO_MINIO=true",
+    )
+    parser.add_argument("--label", default="", help="Метка прогона в результатах")
+    parser.add_argument("--output", help="Файл для результатов в JSON")
+    return parser.parse_args(argv)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_redis(url: str | None) -> str:
+    if url:
+        import redis
+
+        redis.Redis.from_url(url).flushdb()
+        return url
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        sys.exit("Не задан --redis-url и не установлен fakeredis")
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+
+def process_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree(pids: list) -> set:
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, stack = set(), list(pids)
+    while stack:
+        pid = stack.pop()
+        tree.add(pid)
+        stack += [child for child, parent in parents.items() if parent == pid and child not in tree]
+    return tree
+
+
+class RSSSampler:
+    """Пиковая суммарная RSS процессов воркеров вместе с дочерними"""
+
+    def __init__(self, pids: list):
+        self.pids = pids
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _run(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, sum(process_rss(pid) for pid in process_tree(self.pids)))
+
+    def start(self) -> "RSSSampler":
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def start_worker(name: str, queues: list, concurrency: int, pool: str, env: dict, log_path: Path):
+    command = [
+        sys.executable, "-m", "celery", "-A", "src.celery_app", "worker",
+        "--loglevel=warning", "-n", f"{name}@%h", "-Q", ",".join(queues),
+        f"--concurrency={concurrency}", f"--pool={pool}", "--without-gossip", "--without-mingle",
+    ]
+    log = open(log_path, "w")
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_worker(process: subprocess.Popen) -> None:
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(WORKER_STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def percentile(values: list, q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return round(values[index], 3)
+
+
+def latency_summary(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": round(max(values), 3) if values else None,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def completed_files(s3: LocalS3Server, mix: FileMix) -> dict:
+    """Время записи в S3 для файлов, загруженных в итоговой версии"""
+    stored = {}
+    for _, key, obj in s3.store.objects():
+        stored.setdefault(key.rsplit("/", 1)[-1], []).append(obj)
+    done = {}
+    for file in mix.files:
+        versions = [obj for obj in stored.get(file.name, []) if obj["size"] == file.size]
+        if versions and file.appeared_at is not None:
+            done[file.name] = min(obj["stored_at"] for obj in versions)
+    return done
+
+
+def main(argv=None) -> dict:
+    args = parse_args(argv)
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="filemanager-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    sftp_root = workdir / "sftp"
+    (sftp_root / REMOTE_PATH.lstrip("/")).mkdir(parents=True, exist_ok=True)
+
+    redis_url = start_redis(args.redis_url)
+    sftp = LocalSFTPServer(str(sftp_root)).start()
+    s3 = LocalS3Server().start()
+    redis = urlparse(redis_url)
+
+    overrides = dict(item.split("=", 1) for item in args.env)
+    env = {
+        **os.environ,
+        "DB_URL": args.db_url or f"sqlite+aiosqlite:///{workdir / 'bench.sqlite3'}",
+        "CELERY_BROKER": redis_url,
+        "CELERY_BACKEND": redis_url,
+        "REDIS_HOST": redis.hostname,
+        "REDIS_PORT": str(redis.port or 6379),
+        "REDIS_DB": redis.path.lstrip("/") or "0",
+        "LOCAL_DOWNLOAD_PATH": str(workdir / "download"),
+        "MINIO_ENDPOINT": s3.endpoint,
+        "MINIO_ACCESS_KEY": "bench",
+        "MINIO_SECRET_KEY": "bench-secret",
+        "STABLE_QUIET_PERIOD": str(args.quiet_period),
+        **overrides,
+    }
+    # Настройки читаются при импорте src, поэтому окружение задается до него
+    os.environ.update(env)
+    from src.celery_app import celery
+    from src.database import async_session_maker, create_tables
+    from src.manager.crud import ServerDAO
+    from src.manager.schemas import ServerSchema
+    from src.tasks.crud import run_async
+    from src.tasks.monitor import scan_all_servers
+
+    async def add_server():
+        await create_tables()
+        async with async_session_maker() as session:
+            await ServerDAO().add(
+                session=session,
+                values=ServerSchema(
+                    host=sftp.host,
+                    port=sftp.port,
+                    path=REMOTE_PATH,
+                    username="bench",
+                    password="bench",
+                    scanning=True,
+                ),
+            )
+            await session.commit()
+
+    run_async(add_server())
+
+    download_queues = [f"download_queue_{lane}" for lane in LANES] + ["download_queue"]
+    upload_queues = [f"upload_queue_{lane}" for lane in LANES] + ["upload_queue"]
+    workers = [
+        start_worker("bench-download", download_queues, args.download_concurrency, args.pool, env, workdir / "download.log"),
+        start_worker("bench-upload", upload_queues, args.upload_concurrency, args.pool, env, workdir / "upload.log"),
+    ]
+    sampler = RSSSampler([worker.pid for worker in workers]).start()
+    mix = FileMix(
+        str(sftp_root / REMOTE_PATH.lstrip("/")),
+        args.small,
+        args.small_size,
+        args.large,
+        args.large_size,
+        args.growing,
+        args.growing_size,
+        args.grow_steps,
+        args.grow_interval,
+    )
+    try:
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while len(celery.control.ping(timeout=1)) < len(workers):
+            if time.monotonic() > deadline or any(worker.poll() is not None for worker in workers):
+                raise RuntimeError(f"Воркеры не запустились, см. логи в {workdir}")
+        logger.info(f"🚀 Воркеры запущены, генерация {len(mix.files)} файлов")
+
+        started = time.time()
+        mix.start()
+        done = {}
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            scan_started = time.monotonic()
+            scan_all_servers()
+            done = completed_files(s3, mix)
+            logger.info(f"📊 Загружено {len(done)}/{len(mix.files)} файлов")
+            if len(done) == len(mix.files):
+                break
+            time.sleep(max(0.0, args.scan_interval - (time.monotonic() - scan_started)))
+        finished = max(done.values(), default=time.time())
+    finally:
+        sampler.stop()
+        for worker in workers:
+            stop_worker(worker)
+        sftp.stop()
+        s3.stop()
+
+    elapsed = max(finished - started, 1e-9)
+    completed_bytes = sum(file.size for file in mix.files if file.name in done)
+    latencies = {
+        kind: [done[file.name] - file.appeared_at for file in mix.files if file.kind == kind and file.name in done]
+        for kind in ("small", "large", "growing")
+    }
+    result = {
+        "label": args.label,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "redis_url", "db_url", "workdir")
+        },
+        "files_total": len(mix.files),
+        "files_completed": len(done),
+        "bytes_total": mix.total_bytes,
+        "bytes_completed": completed_bytes,
+        "timed_out": len(done) < len(mix.files),
+        "elapsed_seconds": round(elapsed, 3),
+        "files_per_second": round(len(done) / elapsed, 3),
+        "mb_per_second": round(completed_bytes / 1024 / 1024 / elapsed, 3),
+        "latency_seconds": {
+            "all": latency_summary(sum(latencies.values(), [])),
+            **{kind: latency_summary(values) for kind, values in latencies.items() if values},
+        },
+        "peak_rss_mb": {
+            "workers": round(sampler.peak / 1024 / 1024, 1),
+            # Процесс бенчмарка: SFTP-сервер, S3-стенд и сканирование
+            "bench": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "workdir": str(workdir),
+    }
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    main()
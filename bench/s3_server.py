@@ -0,0 +1,195 @@
+import base64
+import hashlib
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from loguru import logger
+
+READ_CHUNK = 1024 * 1024
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>'
+
+
+class ObjectStore:
+    """Объекты S3 стенда: хранятся только размер, ETag, метаданные и время записи.
+
+    Содержимое не сохраняется, чтобы многогигабайтные файлы не занимали
+    память и диск; MD5 считается потоково для проверки Content-MD5 и ETag.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.uploads = {}
+
+    def put(self, bucket: str, key: str, size: int, etag: str, meta: dict) -> None:
+        with self.lock:
+            self.buckets.setdefault(bucket, {})[key] = {
+                "size": size,
+                "etag": etag,
+                "meta": meta,
+                "stored_at": time.time(),
+            }
+
+    def objects(self) -> list:
+        with self.lock:
+            return [
+                (bucket, key, dict(obj))
+                for bucket, objects in self.buckets.items()
+                for key, obj in objects.items()
+            ]
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store: ObjectStore = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body: bytes = b"", headers: dict | None = None) -> None:
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, code: int, error: str) -> None:
+        body = f"{XML_HEADER}<Error><Code>{error}</Code><Message>{error}</Message></Error>"
+        self._send(code, body.encode(), {"Content-Type": "application/xml"})
+
+    def _parse(self):
+        url = urlparse(self.path)
+        bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+        return bucket, key, parse_qs(url.query, keep_blank_values=True)
+
+    def _meta(self) -> dict:
+        return {k: v for k, v in self.headers.items() if k.lower().startswith("x-amz-meta-")}
+
+    def _read_body(self):
+        # Тело читается потоково: считаются только размер и MD5
+        remaining = int(self.headers.get("Content-Length", 0))
+        md5 = hashlib.md5()
+        size = remaining
+        while remaining:
+            chunk = self.rfile.read(min(READ_CHUNK, remaining))
+            if not chunk:
+                break
+            md5.update(chunk)
+            remaining -= len(chunk)
+        return size, md5.digest()
+
+    def do_HEAD(self):
+        bucket, key, _ = self._parse()
+        if not key:
+            return self._send(200 if bucket in self.store.buckets else 404)
+        obj = self.store.buckets.get(bucket, {}).get(key)
+        if not obj:
+            return self._send(404)
+        headers = {
+            "ETag": f'"{obj["etag"]}"',
+            "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+            **obj["meta"],
+        }
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(obj["size"]))
+        self.end_headers()
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        if "location" in query:
+            body = f'{XML_HEADER}<LocationConstraint xmlns="http://s3.amazonaws.com/doc/2006-03-01/"></LocationConstraint>'
+            return self._send(200, body.encode(), {"Content-Type": "application/xml"})
+        return self._error(501, "NotImplemented")
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        if not key:
+            self._read_body()
+            self.store.buckets.setdefault(bucket, {})
+            return self._send(200)
+        if bucket not in self.store.buckets:
+            self._read_body()
+            return self._error(404, "NoSuchBucket")
+        if "x-amz-copy-source" in self.headers:
+            self._read_body()
+            source_bucket, _, source_key = unquote(self.headers["x-amz-copy-source"]).lstrip("/").partition("/")
+            source = self.store.buckets.get(source_bucket, {}).get(source_key)
+            if not source:
+                return self._error(404, "NoSuchKey")
+            self.store.put(bucket, key, source["size"], source["etag"], source["meta"])
+            body = f'{XML_HEADER}<CopyObjectResult><ETag>"{source["etag"]}"</ETag><LastModified>2024-01-01T00:00:00.000Z</LastModified></CopyObjectResult>'
+            return self._send(200, body.encode(), {"Content-Type": "application/xml"})
+        size, md5 = self._read_body()
+        expected = self.headers.get("Content-MD5")
+        if expected and base64.b64decode(expected) != md5:
+            return self._error(400, "BadDigest")
+        if "uploadId" in query:
+            upload = self.store.uploads.get(query["uploadId"][0])
+            if upload is None:
+                return self._error(404, "NoSuchUpload")
+            upload["parts"][int(query["partNumber"][0])] = (size, md5)
+            return self._send(200, headers={"ETag": f'"{md5.hex()}"'})
+        self.store.put(bucket, key, size, md5.hex(), self._meta())
+        return self._send(200, headers={"ETag": f'"{md5.hex()}"'})
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        self._read_body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.store.uploads[upload_id] = {"parts": {}, "meta": self._meta()}
+            body = f"{XML_HEADER}<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            return self._send(200, body.encode(), {"Content-Type": "application/xml"})
+        upload = self.store.uploads.pop(query.get("uploadId", [""])[0], None)
+        if upload is None:
+            return self._error(404, "NoSuchUpload")
+        parts = [upload["parts"][number] for number in sorted(upload["parts"])]
+        etag = hashlib.md5(b"".join(md5 for _, md5 in parts)).hexdigest() + f"-{len(parts)}"
+        self.store.put(bucket, key, sum(size for size, _ in parts), etag, upload["meta"])
+        body = f'{XML_HEADER}<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>"{etag}"</ETag></CompleteMultipartUploadResult>'
+        return self._send(200, body.encode(), {"Content-Type": "application/xml"})
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        if "uploadId" in query:
+            self.store.uploads.pop(query["uploadId"][0], None)
+        else:
+            with self.store.lock:
+                self.store.buckets.get(bucket, {}).pop(key, None)
+        return self._send(204)
+
+
+class LocalS3Server:
+    """S3-совместимый стенд в потоках процесса бенчмарка вместо MinIO.
+
+    Поддерживает только запросы, которые делает MinioClient: проверку и
+    создание бакета, PUT объекта, multipart-загрузку, копирование,
+    HEAD и удаление объекта. Подпись запросов не проверяется.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.store = ObjectStore()
+        handler = type("BoundS3Handler", (S3Handler,), {"store": self.store})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def start(self) -> "LocalS3Server":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"🚀 S3-стенд бенчмарка слушает {self.endpoint}")
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
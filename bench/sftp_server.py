@@ -0,0 +1,119 @@
+import os
+import socket
+import threading
+
+import paramiko
+from loguru import logger
+from paramiko import (
+    AUTH_SUCCESSFUL,
+    OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED,
+    OPEN_SUCCEEDED,
+    SFTP_PERMISSION_DENIED,
+    SFTPAttributes,
+    SFTPHandle,
+    SFTPServer,
+    SFTPServerInterface,
+)
+
+
+class BenchServer(paramiko.ServerInterface):
+    # Любой логин и пароль принимаются: сервер слушает только localhost
+    def check_auth_password(self, username, password):
+        return AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return OPEN_SUCCEEDED
+        return OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class BenchSFTPHandle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+class BenchSFTPInterface(SFTPServerInterface):
+    """SFTP только для чтения поверх локальной директории root"""
+
+    root = None
+
+    def _realpath(self, path: str) -> str:
+        return self.root + self.canonicalize(path)
+
+    def list_folder(self, path):
+        try:
+            path = self._realpath(path)
+            attrs = []
+            for name in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+                attr.filename = name
+                attrs.append(attr)
+            return attrs
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._realpath(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            return SFTP_PERMISSION_DENIED
+        try:
+            handle = BenchSFTPHandle(flags)
+            handle.filename = self._realpath(path)
+            handle.readfile = open(handle.filename, "rb")
+            return handle
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+class LocalSFTPServer:
+    """SFTP-сервер на paramiko в потоках процесса бенчмарка"""
+
+    def __init__(self, root: str, host: str = "127.0.0.1", port: int = 0):
+        self.root = os.path.abspath(root)
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(128)
+        self.host, self.port = self.sock.getsockname()
+        self.interface = type("RootedSFTPInterface", (BenchSFTPInterface,), {"root": self.root})
+        self._transports = []
+
+    def start(self) -> "LocalSFTPServer":
+        threading.Thread(target=self._accept, daemon=True).start()
+        logger.info(f"🚀 SFTP-сервер бенчмарка слушает {self.host}:{self.port}, корень {self.root}")
+        return self
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, self.interface)
+            try:
+                transport.start_server(server=BenchServer())
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка SSH-рукопожатия: {e}")
+                continue
+            self._transports.append(transport)
+
+    def stop(self) -> None:
+        self.sock.close()
+        for transport in self._transports:
+            transport.close()
@@ -7,15 +7,44 @@ celery = Celery(
     "src.celery_app",
     broker=settings.CELERY_BROKER,
     backend=settings.CELERY_BACKEND,
-    include=["src.tasks.monitor", "src.tasks.download", "src.tasks.upload"],
+    include=["src.tasks.monitor", "src.tasks.download", "src.tasks.upload", "src.tasks.staging"],
 )
 
 celery.conf.beat_schedule = {
-    "scan-all-servers-every-minute": {
-        "task": "src.tasks.monitor.scan_all_servers",
-        "schedule": crontab(minute="*/1"),
+    # Каждый сервер сканируется по своему расписанию, см. services/scan_schedule.py
+    "scan-due-servers": {
+        "task": "src.tasks.monitor.scan_due_servers",
+        "schedule": settings.SCAN_TICK,
         "options": {
             "queue": "scan_servers",
+            # Проверки, не взятые воркером до следующей, не накапливаются
+            "expires": settings.SCAN_TICK,
         },
-    }
+    },
+    "sweep-staging-every-10-minutes": {
+        "task": "src.tasks.staging.sweep_staging",
+        "schedule": crontab(minute="*/10"),
+        "options": {
+            "queue": "scan_servers",
+        },
+    },
 }
+
+
+def size_lane(size: int) -> str:
+    """Полоса обработки файла по размеру: small, medium или large"""
+    if size < settings.LANE_SMALL_MAX_SIZE:
+        return "small"
+    if size < settings.LANE_LARGE_MIN_SIZE:
+        return "medium"
+    return "large"
+
+
+# У каждой полосы свои очереди и свои воркеры с отдельной concurrency,
+# поэтому крупные файлы не занимают слоты, нужные мелким
+def download_queue(size: int) -> str:
+    return f"download_queue_{size_lane(size)}"
+
+
+def upload_queue(size: int) -> str:
+    return f"upload_queue_{size_lane(size)}"
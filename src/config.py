@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from loguru import logger
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -15,6 +16,48 @@ class Settings(BaseSettings):
     MINIO_ENDPOINT: str  # MinIO endpoint URL
     MINIO_ACCESS_KEY: str  # MinIO access key
     MINIO_SECRET_KEY: str  # MinIO secret key
+    FILES_TOTAL_CACHE_TTL: int = 10  # Время жизни (сек) кешированного общего количества файлов для API
+    STATUS_BATCH_SIZE: int = 500  # Максимум статусов файлов в одной пачке записи в БД
+    STATUS_FLUSH_INTERVAL: float = 1.0  # Интервал (сек) сброса буфера статусов в БД; 0 — писать сразу
+    STABLE_SCANS: int = 2  # Количество сканирований подряд без изменений, после которого файл считается стабильным
+    STABLE_QUIET_PERIOD: int = 60  # Время (сек) без изменений, после которого файл считается стабильным
+    DISPATCH_BATCH_SIZE: int = 100  # Максимум файлов в одной задаче скачивания
+    DISPATCH_FANOUT: int = 20  # Минимальное число задач, на которое делится небольшая пачка файлов
+    LANE_SMALL_MAX_SIZE: int = 16 * 1024 * 1024  # Файлы меньше этого размера (байт) идут в очереди small
+    LANE_LARGE_MIN_SIZE: int = 1024 * 1024 * 1024  # Файлы от этого размера (байт) идут в очереди large
+    DEDUP_CLAIM_TTL: int = 86400  # Время (сек), в течение которого отправленный в очередь файл не отправляется повторно
+    DEDUP_DONE_TTL: int = 604800  # Время (сек), в течение которого переданный файл не передается повторно
+    TRANSFER_DEFER_DELAY: int = 10  # Задержка (сек) перед повтором задачи, не получившей слот передачи сервера
+    SCAN_MAX_WORKERS: int = 16  # Количество серверов, сканируемых одновременно
+    SCAN_DEADLINE: int = 50  # Общий дедлайн (сек) сканирования всех серверов
+    SCAN_MAX_DEPTH: int = 5  # Глубина рекурсивного сканирования по умолчанию
+    SCAN_TICK: int = 5  # Интервал (сек) проверки расписания сканирования серверов
+    SCAN_MIN_INTERVAL: int = 10  # Интервал (сек) сканирования сервера, на котором появляются файлы, по умолчанию
+    SCAN_MAX_INTERVAL: int = 600  # Предельный интервал (сек) сканирования простаивающего или недоступного сервера по умолчанию
+    SFTP_CONNECT_TIMEOUT: int = 10  # Таймаут (сек) подключения и аутентификации SFTP
+    SFTP_TIMEOUT: int = 30  # Таймаут (сек) одной SFTP-операции
+    SFTP_POOL_MAX_IDLE: int = 4  # Максимум простаивающих SFTP-соединений на сервер в пуле воркера
+    SFTP_POOL_IDLE_TIMEOUT: int = 300  # Время (сек), после которого простаивающее соединение закрывается
+    SFTP_SEGMENT_THRESHOLD: int = 256 * 1024 * 1024  # Размер файла (байт), начиная с которого загрузка идет сегментами
+    SFTP_SEGMENT_SIZE: int = 64 * 1024 * 1024  # Размер одного сегмента (байт)
+    SFTP_SEGMENT_PARALLELISM: int = 4  # Количество параллельных SFTP-каналов на один файл
+    STAGING_QUOTA: int = 0  # Максимум байт в LOCAL_DOWNLOAD_PATH под скачанные и скачиваемые файлы; 0 — без ограничения
+    STAGING_MIN_FREE: int = 1024 * 1024 * 1024  # Минимум свободного места на диске (байт) после скачивания файла
+    STAGING_RESERVATION_TTL: int = 86400  # Время (сек) жизни резерва места; должно превышать ожидание в очереди загрузки
+    STAGING_ORPHAN_AGE: int = 3600  # Возраст (сек) файла без резерва, после которого очистка его удаляет
+    STREAM_TO_MINIO: bool = False  # Потоковая передача SFTP → MinIO без сохранения на локальный диск
+    MINIO_PART_SIZE: int = 16 * 1024 * 1024  # Минимальный размер части multipart-загрузки в MinIO (байт)
+    MINIO_MAX_PARTS: int = 1000  # Максимум частей в одной загрузке; у крупных файлов части увеличиваются
+    MINIO_UPLOAD_THREADS: int = 4  # Количество одновременно загружаемых частей одного файла
+    MINIO_POOL_SIZE: int = 8  # Размер пула HTTP-соединений с MinIO в процессе воркера; для -P threads — concurrency × MINIO_UPLOAD_THREADS
+    MINIO_STREAM_PARTS: int = 4  # Количество одновременно загружаемых частей при потоковой передаче
+    DEDUP_MODE: Literal["off", "reference", "copy"] = "off"  # Дедупликация по содержимому: off, reference — ссылка на объект, copy — копия на стороне MinIO
+    AMQP_URL: str | None = None  # URL брокера AMQP для уведомлений о загруженных файлах; пусто — уведомления отключены
+    AMQP_EXCHANGE: str = "files"  # Exchange (topic) для уведомлений
+    AMQP_ROUTING_KEY: str = "file.uploaded"  # Ключ маршрутизации уведомления о загрузке файла в MinIO
+    OUTBOX_BATCH_SIZE: int = 500  # Максимум уведомлений из outbox в одной пачке публикации с общим ожиданием подтверждений
+    OUTBOX_POLL_INTERVAL: float = 0.5  # Интервал (сек) опроса outbox ретранслятором, когда новых уведомлений нет
+    CHECKSUM_ALGORITHM: str = "sha256"  # Алгоритм hashlib для контрольной суммы содержимого (sha256, blake2b, ...)
     FORMAT_LOG: str = (
         "{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}"  # Log format for Loguru
     )
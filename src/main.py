@@ -2,10 +2,25 @@ from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from loguru import logger
+from redis.asyncio import Redis
 
+from .config import settings
 from .database import create_tables
+from .manager.dependencies import redis
 from .manager.router import router
+from .services.metrics import render_metrics
+
+# Очереди Celery, длина которых выдается в метриках
+QUEUES = ["scan_servers", "download_queue", "upload_queue"] + [
+    f"{stage}_queue_{lane}"
+    for stage in ("download", "upload")
+    for lane in ("small", "medium", "large")
+]
+
+# Длина очередей читается напрямую из Redis-брокера Celery
+broker = Redis.from_url(settings.CELERY_BROKER) if settings.CELERY_BROKER.startswith("redis") else None
 
 
 @asynccontextmanager
@@ -21,5 +36,16 @@ async def lifespan(app: FastAPI):
 app = FastAPI(lifespan=lifespan, title="Api для мониторинга серверов")
 app.include_router(router)
 
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """
+    Метрики конвейера всех воркеров в формате Prometheus.
+    """
+    return PlainTextResponse(
+        await render_metrics(redis, broker, QUEUES),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
 if __name__ == "__main__":
     uvicorn.run("main:app", reload=True)
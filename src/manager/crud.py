@@ -1,16 +1,19 @@
-from typing import Generic, List, Type, TypeVar
+from typing import Generic, List, Optional, Type, TypeVar
 
 from loguru import logger
 from pydantic import BaseModel
 from sqlalchemy import delete as sqlalchemy_delete
-from sqlalchemy import func
+from sqlalchemy import func, or_
+from sqlalchemy import insert as sqlalchemy_insert
 from sqlalchemy import update as sqlalchemy_update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from ..database import Base
-from .models import File, Server
+from .models import File, FileStatus, OutboxMessage, Server
 
 T = TypeVar("T", bound=Base)
 
@@ -144,11 +147,129 @@ class ServerDAO(BaseDAO):
 class FileDAO(BaseDAO):
     model = File
 
-    async def upsert_file(
-        self, session: AsyncSession, filters: BaseModel, values: BaseModel
+    async def find_page(
+        self,
+        session: AsyncSession,
+        limit: int,
+        before_id: Optional[int] = None,
+        offset: int = 0,
     ):
-        file = await self.find_one_or_none(session=session, filters=filters)
-        if file:
-            await self.update(session=session, filters=filters, values=values)
-        else:
-            await self.add(session=session, values=values)
+        # Keyset-пагинация без OFFSET: id растет в порядке вставки, как и created_at
+        logger.info(f"Поиск страницы {self.model.__name__} до ID {before_id}")
+        try:
+            query = select(self.model).order_by(self.model.id.desc())
+            if before_id:
+                query = query.where(self.model.id < before_id)
+            result = await session.execute(query.limit(limit).offset(offset))
+            records = result.scalars().all()
+            logger.info(f"Найдено {len(records)} записей.")
+            return records
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске страницы до ID {before_id}: {e}")
+            raise
+
+    async def find_stored_by_checksum(self, session: AsyncSession, checksum: str):
+        # Путь в MinIO любого уже загруженного файла с таким же содержимым
+        try:
+            query = (
+                select(self.model.minio_path)
+                .where(
+                    self.model.checksum == checksum,
+                    self.model.status == FileStatus.DOWNLOADED_TO_MINIO.value,
+                    self.model.minio_path.is_not(None),
+                )
+                .order_by(self.model.id)
+                .limit(1)
+            )
+            result = await session.execute(query)
+            return result.scalar_one_or_none()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при поиске файла по контрольной сумме {checksum}: {e}")
+            raise
+
+    async def upsert_many(self, session: AsyncSession, values: List[BaseModel]):
+        # Вставка или обновление пачки файлов одним INSERT ... ON CONFLICT DO UPDATE,
+        # возвращает записанные строки целиком
+        if not values:
+            return []
+        rows = [value.model_dump() for value in values]
+        for row in rows:
+            # Явный NULL отменяет default=False: признак дедупликации задают только
+            # итоговые статусы, для остальных файл считается загруженным обычно
+            if row.get("deduplicated") is None:
+                row["deduplicated"] = False
+        logger.info(f"Upsert {len(rows)} записей {self.model.__name__}")
+        try:
+            insert = (
+                postgresql_insert
+                if session.bind.dialect.name == "postgresql"
+                else sqlite_insert
+            )
+            query = insert(self.model).values(rows)
+            query = query.on_conflict_do_update(
+                index_elements=["server_id", "remote_path", "filename", "size"],
+                set_={
+                    "status": query.excluded.status,
+                    "error_message": query.excluded.error_message,
+                    # Путь и контрольная сумма известны не на каждом шаге и не затираются пустыми
+                    "minio_path": func.coalesce(query.excluded.minio_path, self.model.minio_path),
+                    "checksum": func.coalesce(query.excluded.checksum, self.model.checksum),
+                    # Загруженный в MinIO файл меняют только итоговый статус с явным
+                    # признаком и NEW новой передачи (см. where), поэтому значение берется как есть
+                    "deduplicated": query.excluded.deduplicated,
+                    "updated_at": func.now(),
+                },
+                # Статусы пишут разные воркеры со своими буферами: запоздавший
+                # промежуточный статус не откатывает файл, загруженный в MinIO.
+                # Заново файл открывает только новая передача (статус NEW)
+                where=or_(
+                    self.model.status != FileStatus.DOWNLOADED_TO_MINIO.value,
+                    query.excluded.status.in_(
+                        [FileStatus.DOWNLOADED_TO_MINIO.value, FileStatus.NEW.value]
+                    ),
+                ),
+            ).returning(*self.model.__table__.columns)
+            result = await session.execute(query)
+            return result.all()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при upsert записей: {e}")
+            raise
+
+
+class OutboxDAO(BaseDAO):
+    model = OutboxMessage
+
+    async def add_many(self, session: AsyncSession, values: List[dict]):
+        # Вставка пачки уведомлений в транзакции вызывающего кода
+        if not values:
+            return
+        try:
+            await session.execute(sqlalchemy_insert(self.model), values)
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при добавлении уведомлений в outbox: {e}")
+            raise
+
+    async def lock_batch(self, session: AsyncSession, limit: int):
+        # Старейшие уведомления, еще не заблокированные другим ретранслятором.
+        # SKIP LOCKED работает в PostgreSQL; SQLite блокирует базу на запись целиком
+        try:
+            query = (
+                select(self.model)
+                .order_by(self.model.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            result = await session.execute(query)
+            return result.scalars().all()
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при выборке уведомлений из outbox: {e}")
+            raise
+
+    async def delete_many(self, session: AsyncSession, ids: List[int]):
+        if not ids:
+            return
+        try:
+            await session.execute(sqlalchemy_delete(self.model).where(self.model.id.in_(ids)))
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при удалении уведомлений из outbox: {e}")
+            raise
@@ -1,8 +1,14 @@
 from typing import AsyncGenerator
 
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..config import settings
 from ..database import async_session_maker
+from .events import StatusBroadcast
+
+redis = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+status_broadcast = StatusBroadcast(redis)
 
 
 async def get_session_with_commit() -> AsyncGenerator[AsyncSession, None]:
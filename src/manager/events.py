@@ -0,0 +1,64 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from loguru import logger
+from redis.asyncio import Redis
+
+STATUS_CHANNEL = "files:status"  # Канал Redis с записанными в БД статусами файлов
+CLIENT_QUEUE_SIZE = 100  # Максимум неотправленных пачек статусов на одного клиента
+RESUBSCRIBE_DELAY = 3  # Пауза (сек) перед повторной подпиской после ошибки Redis
+RESYNC = None  # Клиент пропустил часть статусов и должен перечитать страницу
+
+
+class StatusBroadcast:
+    """Раздача статусов файлов подключенным браузерам.
+
+    На процесс API приходится одна подписка на канал Redis, пока подключен
+    хотя бы один клиент; каждая пачка статусов раскладывается по очередям
+    клиентов. Отстающему клиенту вместо накопленных пачек отправляется
+    RESYNC, как и всем клиентам после переподключения к Redis.
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._clients: set[asyncio.Queue] = set()
+        self._task = None
+
+    def _send(self, queue: asyncio.Queue, data) -> None:
+        if queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+            data = RESYNC
+        queue.put_nowait(data)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(STATUS_CHANNEL)
+                    async for message in pubsub.listen():
+                        for queue in list(self._clients):
+                            self._send(queue, message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка подписки на статусы файлов: {e}")
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
+                # Статусы, опубликованные без подписки, потеряны
+                for queue in list(self._clients):
+                    self._send(queue, RESYNC)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        """Очередь пачек статусов (JSON) для одного клиента"""
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self._clients.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+        try:
+            yield queue
+        finally:
+            self._clients.discard(queue)
+            if not self._clients and self._task:
+                self._task.cancel()
+                self._task = None
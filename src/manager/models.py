@@ -1,6 +1,6 @@
 from enum import Enum
 
-from sqlalchemy import BigInteger, Boolean, Integer, String
+from sqlalchemy import BigInteger, Boolean, Index, Integer, String, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from ..database import Base
@@ -24,12 +24,39 @@ class Server(Base):
     username: Mapped[str] = mapped_column(String, nullable=False) # Имя пользователя для доступа к серверу
     password: Mapped[str] = mapped_column(String, nullable=False) # Пароль для доступа к серверу
     scanning: Mapped[bool] = mapped_column(Boolean, default=True) # Флаг, указывающий на то, нужно ли сканировать сервер
+    segment_threshold: Mapped[int] = mapped_column(BigInteger, nullable=True) # Порог размера файла для сегментированной загрузки (байт)
+    segment_size: Mapped[int] = mapped_column(BigInteger, nullable=True) # Размер сегмента при загрузке (байт)
+    segment_parallelism: Mapped[int] = mapped_column(Integer, nullable=True) # Количество параллельных SFTP-каналов на файл
+    recursive: Mapped[bool] = mapped_column(Boolean, default=False) # Флаг рекурсивного сканирования подкаталогов
+    max_depth: Mapped[int] = mapped_column(Integer, nullable=True) # Максимальная глубина рекурсивного сканирования
+    include_patterns: Mapped[str] = mapped_column(String, nullable=True) # Шаблоны имен загружаемых файлов через запятую
+    exclude_patterns: Mapped[str] = mapped_column(String, nullable=True) # Шаблоны исключаемых файлов и каталогов через запятую
+    max_transfers: Mapped[int] = mapped_column(Integer, nullable=True) # Максимум одновременных передач с сервера на все воркеры
+    max_bandwidth: Mapped[int] = mapped_column(BigInteger, nullable=True) # Ограничение скорости чтения с сервера (байт/сек)
+    scan_min_interval: Mapped[int] = mapped_column(Integer, nullable=True) # Интервал сканирования (сек), пока на сервере появляются файлы
+    scan_max_interval: Mapped[int] = mapped_column(Integer, nullable=True) # Предельный интервал сканирования (сек) простаивающего сервера
 
 # Модель для хранения информации о файлах
 class File(Base):
-    server_id: Mapped[int] = mapped_column(Integer, nullable=False) # ID сервера, на котором хранится файл
+    __table_args__ = (
+        # Ключ версии файла для INSERT ... ON CONFLICT DO UPDATE
+        UniqueConstraint("server_id", "remote_path", "filename", "size"),
+        Index("ix_files_created_at", "created_at"),
+    )
+
+    server_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True) # ID сервера, на котором хранится файл
+    remote_path: Mapped[str] = mapped_column(String, nullable=False, default="") # Директория файла на сервере
     filename: Mapped[str] = mapped_column(String, nullable=False) # Имя файла
-    status: Mapped[FileStatus] = mapped_column(String, nullable=False)  # Статус файла
+    status: Mapped[FileStatus] = mapped_column(String, nullable=False, index=True)  # Статус файла
     size: Mapped[int] = mapped_column(BigInteger, nullable=False)  # Размер файла в Мб
     minio_path: Mapped[str] = mapped_column(String, nullable=True) # Путь к файлу в MinIO (если используется)
     error_message: Mapped[str] = mapped_column(String, nullable=True) # Сообщение об ошибке (если есть)
+    checksum: Mapped[str] = mapped_column(String, nullable=True, index=True) # Контрольная сумма содержимого вида "алгоритм-tree4m:hex" (хеш дайджестов блоков по 4 МБ)
+    deduplicated: Mapped[bool] = mapped_column(Boolean, nullable=True, default=False) # Файл не загружался: объект с таким содержимым уже был в MinIO
+
+
+# Модель очереди уведомлений (transactional outbox): запись добавляется в одной
+# транзакции со статусом файла и удаляется после подтверждения брокером AMQP
+class OutboxMessage(Base):
+    routing_key: Mapped[str] = mapped_column(String, nullable=False) # Ключ маршрутизации AMQP
+    payload: Mapped[str] = mapped_column(String, nullable=False) # Тело уведомления в JSON
@@ -1,17 +1,39 @@
+import asyncio
 from pathlib import Path
+from typing import Optional
 
 from fastapi import APIRouter, Depends, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..config import settings
 from .crud import FileDAO, ServerDAO
-from .dependencies import get_session_with_commit, get_session_without_commit
+from .dependencies import (
+    get_session_with_commit,
+    get_session_without_commit,
+    redis,
+    status_broadcast,
+)
+from .events import RESYNC
 from .schemas import FileSchema, ServerID, ServerSchema
 
 router = APIRouter()
 
 template = Jinja2Templates(directory=Path(__file__).parent.parent.parent / "templates")
 
+FILES_TOTAL_KEY = "files:total"
+EVENTS_KEEPALIVE = 15  # Интервал (сек) комментариев, удерживающих поток событий открытым
+
+
+async def get_files_total(session: AsyncSession) -> int:
+    # COUNT(*) по всей таблице выполняется не чаще раза в FILES_TOTAL_CACHE_TTL
+    total = await redis.get(FILES_TOTAL_KEY)
+    if total is None:
+        total = await FileDAO().count_all(session=session)
+        await redis.set(FILES_TOTAL_KEY, total, ex=settings.FILES_TOTAL_CACHE_TTL)
+    return int(total)
+
 
 @router.get("/")
 def read_root(request: Request):
@@ -94,8 +116,51 @@ async def get_files(
     session: AsyncSession = Depends(get_session_without_commit),
     limit: int = Query(default=100, lte=1000),
     offset: int = Query(default=0, ge=0),
+    cursor: Optional[int] = Query(
+        default=None, ge=1, description="Курсор следующей страницы из заголовка X-Next-Cursor"
+    ),
 ):
-    total = await FileDAO().count_all(session=session)
-    files = await FileDAO().find_all(session=session, limit=limit, offset=offset)
-    response.headers["X-Total-Count"] = str(total)
+    # С курсором страница выбирается по индексу за постоянное время, OFFSET — для совместимости
+    files = await FileDAO().find_page(
+        session=session,
+        limit=limit,
+        before_id=cursor,
+        offset=0 if cursor else offset,
+    )
+    response.headers["X-Total-Count"] = str(await get_files_total(session))
+    if len(files) == limit:
+        response.headers["X-Next-Cursor"] = str(files[-1].id)
     return files
+
+
+@router.get(
+    "/files/events",
+    status_code=status.HTTP_200_OK,
+    description="Поток изменений статусов файлов (Server-Sent Events)",
+)
+async def file_events():
+    """
+    События files содержат JSON-список записанных в БД файлов, событие
+    resync — признак того, что часть изменений пропущена и страницу
+    нужно перечитать.
+    """
+
+    async def stream():
+        async with status_broadcast.subscribe() as queue:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if data is RESYNC:
+                    yield "event: resync\ndata: {}\n\n"
+                else:
+                    yield f"event: files\ndata: {data.decode()}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
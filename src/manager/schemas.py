@@ -14,6 +14,17 @@ class ServerSchema(ServerID):
     username: str = Field(..., description="Имя пользователя для доступа к серверу", example="admin")
     password: str = Field(..., description="Пароль для доступа к серверу", example="root1234")
     scanning: bool = Field(..., description="Флаг, указывающий на то, нужно ли сканировать сервер", example=True)
+    segment_threshold: Optional[int] = Field(None, description="Порог размера файла для сегментированной загрузки (байт)", example=268435456)
+    segment_size: Optional[int] = Field(None, description="Размер сегмента при загрузке (байт)", example=67108864)
+    segment_parallelism: Optional[int] = Field(None, description="Количество параллельных SFTP-каналов на файл", example=4)
+    recursive: bool = Field(False, description="Флаг рекурсивного сканирования подкаталогов", example=False)
+    max_depth: Optional[int] = Field(None, description="Максимальная глубина рекурсивного сканирования", example=5)
+    include_patterns: Optional[str] = Field(None, description="Шаблоны имен загружаемых файлов через запятую", example="*.csv,*.json")
+    exclude_patterns: Optional[str] = Field(None, description="Шаблоны исключаемых файлов и каталогов через запятую", example="tmp,*.part")
+    max_transfers: Optional[int] = Field(None, description="Максимум одновременных передач с сервера на все воркеры", example=4)
+    max_bandwidth: Optional[int] = Field(None, description="Ограничение скорости чтения с сервера (байт/сек)", example=52428800)
+    scan_min_interval: Optional[int] = Field(None, description="Интервал сканирования (сек), пока на сервере появляются файлы", example=10)
+    scan_max_interval: Optional[int] = Field(None, description="Предельный интервал сканирования (сек) простаивающего сервера", example=600)
 
 
 class FileSchema(BaseModel):
@@ -21,6 +32,7 @@ class FileSchema(BaseModel):
         None, description="Уникальный идентификатор файла", example=1
     )
     server_id: int = Field(..., description="ID сервера, на котором хранится файл", example=1)
+    remote_path: str = Field("", description="Директория файла на сервере", example="/var/files/reports")
     filename: str = Field(..., description="Имя файла", example="example.txt") 
     status: str = Field(..., description="Статус файла", example="new")
     size: float = Field(..., description="Размер файла в байтах", example=1024)
@@ -32,3 +44,17 @@ class FileSchema(BaseModel):
     error_message: Optional[str] = Field(
         None, description="Сообщение об ошибке (если есть)", example="File not found"
     )
+    checksum: Optional[str] = Field(
+        None,
+        description=(
+            "Контрольная сумма содержимого вида \"алгоритм-tree4m:hex\": хеш от "
+            "последовательности дайджестов блоков файла по 4 МБ (последний блок может быть "
+            "короче), а не хеш всего файла — с выводом sha256sum не совпадает"
+        ),
+        example="sha256-tree4m:954d5a49fd70d9b8bcdb35d252267829957f7ef7fa6c74f88419bdc5e82209f4",
+    )
+    deduplicated: Optional[bool] = Field(
+        False,
+        description="Файл не загружался: объект с таким содержимым уже был в MinIO",
+        example=False,
+    )
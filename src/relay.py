@@ -0,0 +1,60 @@
+import asyncio
+
+from loguru import logger
+
+from .config import settings
+from .database import async_session_maker, create_tables
+from .manager.crud import OutboxDAO
+from .services.amqp import publisher
+
+RETRY_DELAY = 5  # Пауза (сек) после ошибки БД или брокера
+
+
+async def relay_batch() -> int:
+    """Публикует одну пачку уведомлений из outbox, возвращает их количество.
+
+    Строки заблокированы до конца транзакции, поэтому параллельные
+    ретрансляторы берут разные пачки. Строка удаляется только после
+    подтверждения брокером; если ретранслятор упадет до коммита,
+    пачка будет опубликована повторно (доставка "хотя бы один раз").
+    """
+    async with async_session_maker() as session:
+        try:
+            rows = await OutboxDAO().lock_batch(session=session, limit=settings.OUTBOX_BATCH_SIZE)
+            if not rows:
+                return 0
+            messages = [(row.routing_key, row.payload) for row in rows]
+            nacked = await asyncio.to_thread(publisher.publish_batch, messages)
+            if nacked:
+                logger.warning(f"⚠️ Брокер отклонил {len(nacked)} уведомлений, повторим")
+            confirmed = set(range(len(rows))) - set(nacked)
+            await OutboxDAO().delete_many(
+                session=session, ids=[rows[index].id for index in sorted(confirmed)]
+            )
+            await session.commit()
+            return len(rows)
+        except Exception:
+            await session.rollback()
+            raise
+
+
+async def main():
+    if not settings.AMQP_URL:
+        logger.error("❌ AMQP_URL не задан, ретранслятор уведомлений не запущен")
+        return
+    await create_tables()
+    logger.info("🚀 Ретранслятор уведомлений outbox → AMQP запущен")
+    while True:
+        try:
+            count = await relay_batch()
+        except Exception as e:
+            logger.error(f"❌ Ошибка публикации уведомлений из outbox: {e}")
+            await asyncio.sleep(RETRY_DELAY)
+            continue
+        # Полная пачка — outbox еще не разобран, берем следующую сразу
+        if count < settings.OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(settings.OUTBOX_POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+from amqp import Connection, Message
+from kombu.utils.url import parse_url
+from loguru import logger
+
+from ..config import settings
+
+CONFIRM_TIMEOUT = 10  # Время (сек) ожидания подтверждений брокера на пачку сообщений
+CONNECT_TIMEOUT = 5  # Таймаут (сек) подключения к брокеру
+
+
+class AMQPPublisher:
+    """Издатель уведомлений с одним долгоживущим соединением и каналом.
+
+    Подтверждения брокера (publisher confirms) ожидаются на всю пачку
+    сразу, а не на каждое сообщение. При ошибке соединение закрывается,
+    следующая пачка отправляется через новое.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connection = None
+        self._channel = None
+        self._next_tag = 1
+        self._pending = {}  # Номер доставки -> индекс сообщения в пачке
+        self._nacked = []
+
+    def _connect(self) -> None:
+        url = parse_url(settings.AMQP_URL)
+        connection = Connection(
+            host=f"{url['hostname'] or 'localhost'}:{url['port'] or 5672}",
+            userid=url["userid"] or "guest",
+            password=url["password"] or "guest",
+            virtual_host=url["virtual_host"] or "/",
+            connect_timeout=CONNECT_TIMEOUT,
+        )
+        connection.connect()
+        channel = connection.channel()
+        channel.exchange_declare(settings.AMQP_EXCHANGE, "topic", durable=True, auto_delete=False)
+        channel.confirm_select()
+        channel.events["basic_ack"].add(self._on_ack)
+        channel.events["basic_nack"].add(self._on_nack)
+        self._connection, self._channel, self._next_tag = connection, channel, 1
+        logger.info(f"✅ Соединение с брокером AMQP {url['hostname']} установлено")
+
+    def _confirmed(self, delivery_tag: int, multiple: bool) -> list:
+        tags = [tag for tag in self._pending if tag <= delivery_tag] if multiple else [delivery_tag]
+        return [self._pending.pop(tag) for tag in tags if tag in self._pending]
+
+    def _on_ack(self, delivery_tag: int, multiple: bool) -> None:
+        self._confirmed(delivery_tag, multiple)
+
+    def _on_nack(self, delivery_tag: int, multiple: bool) -> None:
+        self._nacked += self._confirmed(delivery_tag, multiple)
+
+    def _close(self) -> None:
+        try:
+            if self._connection:
+                self._connection.collect()
+        except Exception:
+            pass
+        self._connection = self._channel = None
+
+    def publish_batch(self, messages: list[tuple[str, str]]) -> list[int]:
+        """Публикует пачку (routing_key, тело JSON) и ждет подтверждения брокера.
+
+        Возвращает индексы сообщений, отклоненных брокером; при ошибке
+        соединения или таймауте подтверждений выбрасывает исключение.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Соединение родительского процесса не используем
+                self._pid = os.getpid()
+                self._connection = self._channel = None
+            try:
+                if self._connection is None:
+                    self._connect()
+                self._pending, self._nacked = {}, []
+                for index, (routing_key, body) in enumerate(messages):
+                    self._pending[self._next_tag] = index
+                    self._next_tag += 1
+                    self._channel.basic_publish(
+                        Message(body, content_type="application/json", delivery_mode=2),
+                        exchange=settings.AMQP_EXCHANGE,
+                        routing_key=routing_key,
+                    )
+                deadline = time.monotonic() + CONFIRM_TIMEOUT
+                while self._pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Нет подтверждения для {len(self._pending)} сообщений")
+                    self._connection.drain_events(timeout=remaining)
+                return sorted(self._nacked)
+            except Exception:
+                self._close()
+                raise
+
+
+publisher = AMQPPublisher()
@@ -0,0 +1,95 @@
+import hashlib
+import math
+
+from ..config import settings
+
+BLOCK_SIZE = 4 * 1024 * 1024  # Размер блока (байт), по которому хешируется содержимое
+# Суффикс алгоритма в контрольной сумме: это хеш дерева блоков, а не хеш
+# всего файла, и sha256sum файла с ним не совпадает
+TREE_SUFFIX = f"-tree{BLOCK_SIZE // 1024 // 1024}m"
+
+
+def part_size_for(size: int) -> int:
+    """Размер части multipart-загрузки файла: не меньше MINIO_PART_SIZE, не больше
+    MINIO_MAX_PARTS частей на файл, кратен BLOCK_SIZE"""
+    part_size = max(settings.MINIO_PART_SIZE, math.ceil(size / settings.MINIO_MAX_PARTS))
+    return math.ceil(part_size / BLOCK_SIZE) * BLOCK_SIZE
+
+
+def segment_alignment(size: int) -> int:
+    # Сегмент загрузки должен начинаться на границе и блока, и части multipart-загрузки;
+    # часть кратна блоку, поэтому достаточно границы части
+    return part_size_for(size)
+
+
+# Хеширование непрерывного диапазона файла, начинающегося на границе сегмента
+class RangeHasher:
+    def __init__(self, digest: "TransferDigest", offset: int):
+        self.digest = digest
+        self.position = offset
+        self._block = None
+        self._part = None
+
+    def update(self, data: bytes) -> None:
+        digest = self.digest
+        view = memoryview(data)
+        while view:
+            block_end = min((self.position // BLOCK_SIZE + 1) * BLOCK_SIZE, digest.size)
+            part_end = min((self.position // digest.part_size + 1) * digest.part_size, digest.size)
+            n = min(len(view), block_end - self.position, part_end - self.position)
+            if self._block is None:
+                self._block = hashlib.new(digest.algorithm)
+            if self._part is None:
+                self._part = hashlib.md5()
+            self._block.update(view[:n])
+            self._part.update(view[:n])
+            self.position += n
+            view = view[n:]
+            if self.position == block_end:
+                digest.blocks[(self.position - 1) // BLOCK_SIZE] = self._block.digest()
+                self._block = None
+            if self.position == part_end:
+                digest.parts[(self.position - 1) // digest.part_size] = self._part.digest()
+                self._part = None
+
+
+class TransferDigest:
+    """Контрольные суммы файла, считаемые по ходу скачивания.
+
+    Содержимое хешируется блоками по BLOCK_SIZE, итоговый дайджест — хеш от
+    дайджестов блоков, поэтому сегменты считаются независимо и в любом порядке.
+    Дайджест записывается как "алгоритм-tree4m:hex", например
+    "sha256-tree4m:...", чтобы его не путали с хешем всего файла.
+    Одновременно считаются MD5 частей по part_size_for(size), из которых
+    получается ожидаемый ETag объекта в MinIO.
+    """
+
+    def __init__(self, size: int, algorithm: str | None = None):
+        self.size = size
+        self.algorithm = algorithm or settings.CHECKSUM_ALGORITHM
+        self.part_size = part_size_for(size)
+        self.blocks = {}
+        self.parts = {}
+        hashlib.new(self.algorithm)  # Неизвестный алгоритм — ошибка до начала загрузки
+
+    def hasher(self, offset: int) -> RangeHasher:
+        return RangeHasher(self, offset)
+
+    def hexdigest(self) -> str:
+        count = max(1, math.ceil(self.size / BLOCK_SIZE))
+        if self.size == 0:
+            self.blocks.setdefault(0, hashlib.new(self.algorithm).digest())
+        combined = hashlib.new(self.algorithm)
+        for index in range(count):
+            combined.update(self.blocks[index])
+        return f"{self.algorithm}{TREE_SUFFIX}:{combined.hexdigest()}"
+
+    def etag(self) -> str:
+        # MinIO загружает файл одним PUT, если он помещается в одну часть
+        count = max(1, math.ceil(self.size / self.part_size))
+        if self.size == 0:
+            self.parts.setdefault(0, hashlib.md5().digest())
+        if count == 1:
+            return self.parts[0].hex()
+        combined = hashlib.md5(b"".join(self.parts[index] for index in range(count)))
+        return f"{combined.hexdigest()}-{count}"
@@ -0,0 +1,129 @@
+import threading
+import uuid
+from contextlib import contextmanager
+
+from loguru import logger
+from redis import Redis
+
+from ..config import settings
+
+LEASE_TTL = 60  # Время (сек), через которое аренда упавшего воркера освобождается сама
+
+# Состояния версии файла: queued — задача отправлена, active:<токен> — файл
+# передает воркер, done — файл передан. Возвращает 1, если аренда получена,
+# 0 — файл передает другой воркер, -1 — файл уже передан.
+ACQUIRE_SCRIPT = """
+local state = redis.call('GET', KEYS[1])
+if state == 'done' then
+    return -1
+end
+if state and string.sub(state, 1, 7) == 'active:' then
+    return 0
+end
+redis.call('SET', KEYS[1], 'active:' .. ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# Меняет состояние, только если аренда принадлежит воркеру; пустое новое
+# состояние означает продление аренды
+TRANSITION_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= 'active:' .. ARGV[1] then
+    return 0
+end
+if ARGV[2] == '' then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+else
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+return 1
+"""
+
+
+class DuplicateTransfer(Exception):
+    """Версия файла уже передана или передается другим воркером"""
+
+
+class FileLease:
+    def __init__(self, dedup: "FileDedup", key: str, token: str):
+        self.dedup = dedup
+        self.key = key
+        self.token = token
+        self.completed = False
+
+    def complete(self) -> None:
+        # Файл уже передан: ошибка Redis не должна приводить к повторной передаче
+        try:
+            self.completed = self.dedup._transition(
+                self.key, self.token, "done", settings.DEDUP_DONE_TTL
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось отметить {self.key} переданным: {e}")
+
+
+# Идемпотентность передачи: каждая версия файла (сервер, путь, имя, размер, mtime)
+# захватывается при отправке задачи и передается не более одного раза
+class FileDedup:
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._acquire = redis.register_script(ACQUIRE_SCRIPT)
+        self._transition_script = redis.register_script(TRANSITION_SCRIPT)
+
+    @staticmethod
+    def _key(server_id: int, remote_path: str, filename: str, size: int, mtime) -> str:
+        return f"dedup:{server_id}:{remote_path}/{filename}:{size}:{int(mtime or 0)}"
+
+    def _transition(self, key: str, token: str, state: str, ttl: int) -> bool:
+        return bool(self._transition_script(keys=[key], args=[token, state, ttl]))
+
+    def claim_many(self, server_id: int, remote_path: str, files: list) -> list:
+        """Захватывает версии файлов при отправке; возвращает еще не захваченные"""
+        pipeline = self.redis.pipeline(transaction=False)
+        for file in files:
+            pipeline.set(
+                self._key(server_id, remote_path, file.filename, file.st_size, file.st_mtime),
+                "queued",
+                nx=True,
+                ex=settings.DEDUP_CLAIM_TTL,
+            )
+        return [file for file, claimed in zip(files, pipeline.execute()) if claimed]
+
+    def _keep_alive(self, key: str, token: str, stop: threading.Event) -> None:
+        while not stop.wait(LEASE_TTL / 3):
+            try:
+                if not self._transition(key, token, "", LEASE_TTL):
+                    logger.warning(f"⚠️ Аренда {key} истекла до окончания передачи")
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось продлить аренду {key}: {e}")
+
+    @contextmanager
+    def lease(self, server_id: int, remote_path: str, file: dict):
+        """Аренда версии файла на время передачи или DuplicateTransfer.
+
+        Если передача не отмечена завершенной, версия возвращается в состояние
+        queued, и повторная попытка задачи сможет снова ее арендовать.
+        """
+        key = self._key(server_id, remote_path, file["filename"], file["st_size"], file["st_mtime"])
+        token = uuid.uuid4().hex
+        state = self._acquire(keys=[key], args=[token, LEASE_TTL])
+        if state == -1:
+            raise DuplicateTransfer(f"Файл {file['filename']} уже передан")
+        if state == 0:
+            raise DuplicateTransfer(f"Файл {file['filename']} передается другим воркером")
+        lease = FileLease(self, key, token)
+        stop = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(key, token, stop), daemon=True).start()
+        try:
+            yield lease
+        finally:
+            stop.set()
+            if not lease.completed:
+                try:
+                    self._transition(key, token, "queued", settings.DEDUP_CLAIM_TTL)
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось освободить аренду {key}: {e}")
+
+
+file_dedup = FileDedup(
+    Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+)
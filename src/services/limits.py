@@ -0,0 +1,130 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from loguru import logger
+from redis import Redis
+
+from ..config import settings
+
+SLOT_TTL = 60  # Время (сек), через которое слот упавшего воркера освобождается сам
+THROTTLE_CHUNK = 256 * 1024  # Объем (байт), накапливаемый перед запросом токенов в Redis
+
+# Семафор на sorted set: участник — токен слота, score — срок его действия.
+# Просроченные слоты удаляются перед проверкой лимита.
+ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Продлевает слот, если он еще принадлежит воркеру
+HEARTBEAT_SCRIPT = """
+local now = redis.call('TIME')
+if redis.call('ZSCORE', KEYS[1], ARGV[2]) then
+    redis.call('ZADD', KEYS[1], tonumber(now[1]) + tonumber(ARGV[1]), ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Token bucket с запасом на одну секунду. Токены списываются сразу, даже в долг,
+# а вызывающему возвращается время (сек), которое нужно подождать.
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate, amount = tonumber(ARGV[1]), tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or rate
+local ts = tonumber(state[2]) or now
+tokens = math.min(rate, tokens + (now - ts) * rate) - amount
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 60)
+if tokens < 0 then
+    return tostring(-tokens / rate)
+end
+return '0'
+"""
+
+
+class SlotUnavailable(Exception):
+    """Все слоты передачи для сервера заняты"""
+
+
+# Ограничитель скорости одной передачи: байты копятся локально и
+# списываются из общего для всех воркеров бакета сервера
+class Throttle:
+    def __init__(self, limits: "ServerLimits", server_id: int, rate: int):
+        self.limits = limits
+        self.server_id = server_id
+        self.rate = rate
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, nbytes: int) -> None:
+        with self._lock:
+            self._pending += nbytes
+            if self._pending < min(THROTTLE_CHUNK, self.rate):
+                return
+            amount, self._pending = self._pending, 0
+        delay = self.limits.consume(self.server_id, self.rate, amount)
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Лимиты серверов, общие для всех воркеров кластера: число одновременных
+# передач (семафор) и скорость чтения в байтах/сек (token bucket)
+class ServerLimits:
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._acquire = redis.register_script(ACQUIRE_SCRIPT)
+        self._heartbeat = redis.register_script(HEARTBEAT_SCRIPT)
+        self._consume = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def _keep_alive(self, key: str, token: str, stop: threading.Event) -> None:
+        while not stop.wait(SLOT_TTL / 3):
+            try:
+                if not self._heartbeat(keys=[key], args=[SLOT_TTL, token]):
+                    logger.warning(f"⚠️ Слот {key} истек до окончания передачи")
+                    return
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось продлить слот {key}: {e}")
+
+    @contextmanager
+    def transfer_slot(self, server_id: int, limit: int | None):
+        """Занимает слот передачи для сервера или бросает SlotUnavailable"""
+        if not limit:
+            yield
+            return
+        key = f"limits:transfers:{server_id}"
+        token = uuid.uuid4().hex
+        if not self._acquire(keys=[key], args=[limit, SLOT_TTL, token]):
+            raise SlotUnavailable(f"Достигнут лимит {limit} одновременных передач сервера {server_id}")
+        stop = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(key, token, stop), daemon=True).start()
+        try:
+            yield
+        finally:
+            stop.set()
+            self.redis.zrem(key, token)
+
+    def consume(self, server_id: int, rate: int, amount: int) -> float:
+        return float(
+            self._consume(keys=[f"limits:bandwidth:{server_id}"], args=[rate, amount])
+        )
+
+    def throttle(self, server_id: int, rate: int | None) -> Throttle | None:
+        return Throttle(self, server_id, rate) if rate else None
+
+
+server_limits = ServerLimits(
+    Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+)
@@ -0,0 +1,218 @@
+import math
+from collections import defaultdict
+from contextlib import contextmanager
+
+from loguru import logger
+from redis import Redis
+
+from ..config import settings
+
+PREFIX = "filemanager"
+METRICS_KEY = "metrics:hist:{name}"  # Хеш с бакетами, суммой и количеством наблюдений метрики
+POOL_STATS_PATTERN = "metrics:minio_pool:*"
+
+# Границы бакетов гистограмм
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+WAIT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+DB_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+THROUGHPUT_BUCKETS = tuple(2**power for power in range(16, 31, 2))  # 64 КБ/с ... 1 ГБ/с
+
+redis = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Гистограмма в Redis, общая для всех процессов воркеров.
+
+    Для каждого набора меток хранится количество наблюдений в каждом
+    бакете (не накопительно), сумма и общее количество; накопительные
+    значения считаются при выдаче метрик.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: tuple, buckets: tuple):
+        self.name = f"{PREFIX}_{name}"
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.key = METRICS_KEY.format(name=self.name)
+
+    def _label_string(self, labels: dict) -> str:
+        return ",".join(f'{label}="{_escape(labels[label])}"' for label in self.labels)
+
+    def observe(self, value: float, pipeline=None, **labels) -> None:
+        with metrics_pipeline(pipeline) as pipe:
+            series = self._label_string(labels)
+            bucket = next(le for le in self.buckets if value <= le)
+            pipe.hincrby(self.key, f"{series}|{_format_number(bucket)}", 1)
+            pipe.hincrbyfloat(self.key, f"{series}|sum", value)
+            pipe.hincrby(self.key, f"{series}|count", 1)
+
+    def render(self, stored: dict) -> list[str]:
+        series = defaultdict(dict)
+        for field, value in stored.items():
+            labels, _, kind = field.decode().rpartition("|")
+            series[labels][kind] = float(value)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, values in sorted(series.items()):
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for le in self.buckets:
+                cumulative += values.get(_format_number(le), 0)
+                lines.append(
+                    f'{self.name}_bucket{{{prefix}le="{_format_number(le)}"}} {_format_number(cumulative)}'
+                )
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {_format_number(values.get('sum', 0))}")
+            lines.append(f"{self.name}_count{suffix} {_format_number(values.get('count', 0))}")
+        return lines
+
+
+class Counter(Histogram):
+    """Счетчик в Redis, общий для всех процессов воркеров"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple):
+        super().__init__(name, documentation, labels, ())
+
+    def inc(self, value: float = 1, pipeline=None, **labels) -> None:
+        with metrics_pipeline(pipeline) as pipe:
+            pipe.hincrbyfloat(self.key, self._label_string(labels), value)
+
+    def render(self, stored: dict) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted((field.decode(), float(value)) for field, value in stored.items()):
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}{suffix} {_format_number(value)}")
+        return lines
+
+
+@contextmanager
+def metrics_pipeline(pipeline=None):
+    """Pipeline Redis для записи метрик одним запросом.
+
+    Ошибка записи метрик только логируется и не прерывает обработку файлов.
+    """
+    if pipeline is not None:
+        yield pipeline
+        return
+    pipe = redis.pipeline(transaction=False)
+    try:
+        yield pipe
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сохранить метрики: {str(e)}")
+
+
+SCAN_DURATION = Histogram(
+    "scan_duration_seconds", "Длительность сканирования пути сервера", ("server",), DURATION_BUCKETS
+)
+STABILITY_WAIT = Histogram(
+    "stability_wait_seconds",
+    "Время от обнаружения версии файла до признания ее стабильной",
+    ("server", "size"),
+    WAIT_BUCKETS,
+)
+TRANSFER_DURATION = Histogram(
+    "transfer_duration_seconds",
+    "Длительность скачивания файла с SFTP-сервера",
+    ("server", "size"),
+    DURATION_BUCKETS,
+)
+TRANSFER_THROUGHPUT = Histogram(
+    "transfer_throughput_bytes_per_second",
+    "Скорость скачивания файла с SFTP-сервера",
+    ("server", "size"),
+    THROUGHPUT_BUCKETS,
+)
+TRANSFERRED_BYTES = Counter(
+    "transferred_bytes_total", "Байт, скачанных с SFTP-сервера", ("server", "size")
+)
+UPLOAD_DURATION = Histogram(
+    "upload_duration_seconds", "Длительность загрузки файла в MinIO", ("server", "size"), DURATION_BUCKETS
+)
+STATUS_DURATION = Histogram(
+    "file_status_duration_seconds",
+    "Время, проведенное файлом в статусе",
+    ("server", "size", "status"),
+    WAIT_BUCKETS,
+)
+DB_WRITE_DURATION = Histogram(
+    "db_write_duration_seconds", "Длительность записи пачки статусов в БД", (), DB_BUCKETS
+)
+
+METRICS = (
+    SCAN_DURATION,
+    STABILITY_WAIT,
+    TRANSFER_DURATION,
+    TRANSFER_THROUGHPUT,
+    TRANSFERRED_BYTES,
+    UPLOAD_DURATION,
+    STATUS_DURATION,
+    DB_WRITE_DURATION,
+)
+
+
+def _gauge(name: str, documentation: str, samples: list) -> list[str]:
+    lines = [f"# HELP {PREFIX}_{name} {documentation}", f"# TYPE {PREFIX}_{name} gauge"]
+    for labels, value in samples:
+        suffix = "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}" if labels else ""
+        lines.append(f"{PREFIX}_{name}{suffix} {_format_number(value)}")
+    return lines
+
+
+async def render_metrics(redis, broker=None, queues: list | None = None) -> str:
+    """Метрики всех воркеров в текстовом формате Prometheus.
+
+    redis и broker — асинхронные клиенты Redis с метриками и брокером Celery.
+    """
+    pipeline = redis.pipeline(transaction=False)
+    for metric in METRICS:
+        pipeline.hgetall(metric.key)
+    lines = []
+    for metric, stored in zip(METRICS, await pipeline.execute()):
+        lines += metric.render(stored)
+
+    if broker is not None and queues:
+        pipeline = broker.pipeline(transaction=False)
+        for queue in queues:
+            pipeline.llen(queue)
+        lengths = await pipeline.execute()
+        lines += _gauge(
+            "queue_length",
+            "Количество задач в очереди Celery",
+            [({"queue": queue}, length) for queue, length in zip(queues, lengths)],
+        )
+
+    staged = await redis.get("staging:used")
+    lines += _gauge(
+        "staging_reserved_bytes",
+        "Место, зарезервированное в промежуточном каталоге",
+        [({}, int(staged or 0))],
+    )
+
+    # Пулы соединений с MinIO суммируются по всем процессам воркеров
+    pool = defaultdict(float)
+    workers = 0
+    async for key in redis.scan_iter(match=POOL_STATS_PATTERN, count=1000):
+        stats = await redis.hgetall(key)
+        workers += 1
+        for field, value in stats.items():
+            pool[field.decode()] += float(value)
+    lines += _gauge("minio_pool_workers", "Процессы, сообщившие статистику пула MinIO", [({}, workers)])
+    for field, documentation in (
+        ("connections", "Соединений с MinIO, открытых за время жизни процессов"),
+        ("requests", "Запросов к MinIO через пулы соединений"),
+        ("in_use", "Соединений с MinIO, занятых запросами"),
+        ("idle", "Простаивающих соединений с MinIO в пулах"),
+        ("maxsize", "Суммарный размер пулов соединений с MinIO"),
+    ):
+        lines += _gauge(f"minio_pool_{field}", documentation, [({}, pool[field])])
+    return "\n".join(lines) + "\n"
@@ -1,26 +1,239 @@
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import certifi
+import urllib3
 from loguru import logger
 from minio import Minio
+from minio.commonconfig import CopySource
+from minio.datatypes import Part
 from minio.error import S3Error
+from minio.helpers import genheaders
 
 from ..config import settings
+from .checksum import TransferDigest, part_size_for
+
+MINIO_TIMEOUT = 300  # Таймаут (сек) подключения и чтения HTTP-запроса к MinIO
+
+# Бакеты, существование которых уже проверено в этом процессе
+_known_buckets = set()
+_known_buckets_lock = threading.Lock()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_minio_client() -> Minio:
+    """Клиент MinIO процесса воркера, создается при первом обращении.
+
+    Один пул HTTP-соединений на процесс сохраняет keep-alive соединения
+    между задачами вместо установки новых для каждого файла.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        # Соединения, унаследованные от родительского процесса, не используем
+        if _client_pid != os.getpid():
+            _client = Minio(
+                endpoint=settings.MINIO_ENDPOINT,
+                access_key=settings.MINIO_ACCESS_KEY,
+                secret_key=settings.MINIO_SECRET_KEY,
+                secure=False,
+                http_client=urllib3.PoolManager(
+                    timeout=urllib3.Timeout(connect=MINIO_TIMEOUT, read=MINIO_TIMEOUT),
+                    maxsize=settings.MINIO_POOL_SIZE,
+                    cert_reqs="CERT_REQUIRED",
+                    ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+                    retries=urllib3.Retry(
+                        total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]
+                    ),
+                ),
+            )
+            _client_pid = os.getpid()
+        return _client
+
+
+def pool_stats() -> dict:
+    """Использование пула HTTP-соединений с MinIO в текущем процессе"""
+    stats = {"connections": 0, "requests": 0, "in_use": 0, "idle": 0, "maxsize": 0}
+    if _client is None or _client_pid != os.getpid():
+        return stats
+    http = _client._http
+    for key in list(http.pools.keys()):
+        pool = http.pools.get(key)
+        if pool is None or pool.pool is None:
+            continue
+        idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        stats["connections"] += pool.num_connections
+        stats["requests"] += pool.num_requests
+        stats["in_use"] += pool.pool.maxsize - pool.pool.qsize()
+        stats["idle"] += idle
+        stats["maxsize"] += pool.pool.maxsize
+    return stats
 
 
 class MinioClient:
     def __init__(self):
-        self.client = Minio(
-            endpoint=settings.MINIO_ENDPOINT,
-            access_key=settings.MINIO_ACCESS_KEY,
-            secret_key=settings.MINIO_SECRET_KEY,
-            secure=False,
-        )
+        self.client = get_minio_client()
 
-    def upload_file(self, bucket_name: str, local_path: str, minio_path: str) -> None:
+    def _ensure_bucket(self, bucket_name: str) -> None:
+        if bucket_name in _known_buckets:
+            return
         # Проверяем, существует ли бакет
         if not self.client.bucket_exists(bucket_name):
-            self.client.make_bucket(bucket_name)
-        # Загружаем файл по нужному пути
+            try:
+                self.client.make_bucket(bucket_name)
+            except S3Error as err:
+                # Бакет мог создать другой воркер между проверкой и созданием
+                if err.code not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists"):
+                    raise
+        with _known_buckets_lock:
+            _known_buckets.add(bucket_name)
+
+    def _verify(self, bucket_name: str, minio_path: str, result, etag: str | None) -> None:
+        # ETag MinIO считает по принятым байтам; сверяем с MD5, посчитанным при скачивании
+        if etag and result.etag.strip('"') != etag:
+            self.client.remove_object(bucket_name, minio_path)
+            raise ValueError(
+                f"ETag {result.etag} объекта {minio_path} не совпадает с ожидаемым {etag}"
+            )
+
+    @staticmethod
+    def _read_part(local_path: str, offset: int, length: int) -> tuple[bytes, dict]:
+        with open(local_path, "rb") as local:
+            local.seek(offset)
+            data = local.read(length)
+        if len(data) != length:
+            raise IOError(f"Файл {local_path} короче ожидаемого")
+        headers = {"Content-MD5": base64.b64encode(hashlib.md5(data).digest()).decode()}
+        return data, headers
+
+    def _upload_part(
+        self,
+        bucket_name: str,
+        minio_path: str,
+        local_path: str,
+        upload_id: str,
+        part_number: int,
+        offset: int,
+        length: int,
+    ) -> Part:
+        data, headers = self._read_part(local_path, offset, length)
+        etag = self.client._upload_part(
+            bucket_name, minio_path, data, headers, upload_id, part_number
+        )
+        return Part(part_number, etag)
+
+    def _upload_multipart(
+        self, bucket_name: str, minio_path: str, local_path: str, size: int, headers: dict
+    ):
+        part_size = part_size_for(size)
+        upload_id = self.client._create_multipart_upload(bucket_name, minio_path, headers)
         try:
-            self.client.fput_object(bucket_name, minio_path, local_path)
+            with ThreadPoolExecutor(max_workers=settings.MINIO_UPLOAD_THREADS) as executor:
+                futures = [
+                    executor.submit(
+                        self._upload_part,
+                        bucket_name,
+                        minio_path,
+                        local_path,
+                        upload_id,
+                        number,
+                        offset,
+                        min(part_size, size - offset),
+                    )
+                    for number, offset in enumerate(range(0, size, part_size), start=1)
+                ]
+                try:
+                    parts = [future.result() for future in as_completed(futures)]
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            parts.sort(key=lambda part: part.part_number)
+            return self.client._complete_multipart_upload(
+                bucket_name, minio_path, upload_id, parts
+            )
+        except BaseException:
+            # Незавершенная загрузка иначе занимает место в MinIO до ручной очистки
+            try:
+                self.client._abort_multipart_upload(bucket_name, minio_path, upload_id)
+            except Exception as err:
+                logger.warning(f"Не удалось отменить загрузку {upload_id} для {minio_path}: {err}")
+            raise
+
+    def upload_file(
+        self,
+        bucket_name: str,
+        local_path: str,
+        minio_path: str,
+        checksum: str | None = None,
+        etag: str | None = None,
+    ) -> None:
+        self._ensure_bucket(bucket_name)
+        size = os.path.getsize(local_path)
+        headers = genheaders({"checksum": checksum} if checksum else None, None, None, None, False)
+        headers["Content-Type"] = "application/octet-stream"
+        # Файл в пределах одной части загружается одним PUT, крупный — частями
+        # по part_size_for(size) в MINIO_UPLOAD_THREADS потоков
+        try:
+            if size <= part_size_for(size):
+                data, part_headers = self._read_part(local_path, 0, size)
+                result = self.client._put_object(
+                    bucket_name, minio_path, data, {**headers, **part_headers}
+                )
+            else:
+                result = self._upload_multipart(bucket_name, minio_path, local_path, size, headers)
         except S3Error as err:
             logger.error(f"Ошибка загрузки файла в MinIO: {err}")
             raise
+        self._verify(bucket_name, minio_path, result, etag)
+
+    def object_exists(self, path: str) -> bool:
+        bucket_name, minio_path = path.split("/", 1)
+        try:
+            self.client.stat_object(bucket_name, minio_path)
+            return True
+        except S3Error as err:
+            if err.code in ("NoSuchKey", "NoSuchBucket", "NoSuchObject"):
+                return False
+            raise
+
+    def copy_object(self, bucket_name: str, minio_path: str, source: str) -> None:
+        # Копирование на стороне MinIO: байты объекта не передаются через воркер
+        self._ensure_bucket(bucket_name)
+        source_bucket, source_path = source.split("/", 1)
+        try:
+            self.client.copy_object(bucket_name, minio_path, CopySource(source_bucket, source_path))
+        except S3Error as err:
+            logger.error(f"Ошибка копирования объекта {source} в MinIO: {err}")
+            raise
+
+    def upload_stream(
+        self,
+        bucket_name: str,
+        minio_path: str,
+        data,
+        length: int,
+        digest: TransferDigest | None = None,
+    ) -> None:
+        self._ensure_bucket(bucket_name)
+        # Память ограничена MINIO_STREAM_PARTS частями "в полете" плюс одной читаемой
+        try:
+            result = self.client.put_object(
+                bucket_name,
+                minio_path,
+                data,
+                length,
+                part_size=part_size_for(length),
+                num_parallel_uploads=settings.MINIO_STREAM_PARTS,
+            )
+        except S3Error as err:
+            logger.error(f"Ошибка потоковой загрузки файла в MinIO: {err}")
+            raise
+        # Дайджест готов только после чтения всего потока, поэтому в метаданные
+        # объекта он не попадает и хранится только в БД
+        self._verify(bucket_name, minio_path, result, digest.etag() if digest else None)
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import struct
+import time
+import zlib
+from collections import defaultdict
+
+from loguru import logger
+from redis import Redis
+
+from ..config import settings
+
+CACHE_TTL = 604800  # TTL кеша сканирования (7 дней)
+BUCKETS = 256  # Количество бакетов, на которые делится листинг директории
+
+# Возвращает дайджесты бакетов и продлевает TTL всех ключей кеша директории
+FETCH_SCRIPT = """
+local digests = redis.call('HGETALL', KEYS[1])
+if #digests > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    for i = 1, #digests, 2 do
+        redis.call('EXPIRE', ARGV[1] .. ':' .. digests[i], ARGV[2])
+    end
+end
+return digests
+"""
+
+# Продлевает TTL всех ключей кеша директории, листинг которой не перечитывался
+TOUCH_SCRIPT = """
+for _, bucket in ipairs(redis.call('HKEYS', KEYS[1])) do
+    redis.call('EXPIRE', ARGV[1] .. ':' .. bucket, ARGV[2])
+end
+return redis.call('EXPIRE', KEYS[1], ARGV[2])
+"""
+
+# Сравнивает изменившиеся бакеты с кешем, ведет учет стабильности файлов,
+# удаляет исчезнувшие файлы и возвращает имена файлов, готовых к загрузке.
+# KEYS[1] — дайджесты бакетов, KEYS[2] — файлы в ожидании стабилизации,
+# KEYS[3..] — хеши изменившихся бакетов.
+# ARGV: now, stable_scans, quiet_period, ttl, затем для каждого бакета:
+# номер, дайджест, количество файлов и пары имя/версия.
+# Возвращает готовые файлы, количество файлов, еще ожидающих стабилизации,
+# и время (сек) ожидания стабилизации каждого готового файла.
+DIFF_SCRIPT = """
+local now, stable_scans = tonumber(ARGV[1]), tonumber(ARGV[2])
+local quiet, ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+local ready, waits, current = {}, {}, {}
+local i, k = 5, 3
+while i <= #ARGV do
+    local bucket, digest, count = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+    local key, names, has_pending = KEYS[k], {}, false
+    i = i + 3
+    for _ = 1, count do
+        local name, version = ARGV[i], ARGV[i + 1]
+        i = i + 2
+        names[name] = true
+        current[name] = true
+        if redis.call('HGET', key, name) ~= version then
+            local seen, since = 1, now
+            local pending = redis.call('HGET', KEYS[2], name)
+            if pending and string.sub(pending, 1, 16) == version then
+                local s, t = string.match(string.sub(pending, 17), '^:(%d+):(%d+)$')
+                seen, since = tonumber(s) + 1, tonumber(t)
+            end
+            if seen >= stable_scans or now - since >= quiet then
+                redis.call('HSET', key, name, version)
+                redis.call('HDEL', KEYS[2], name)
+                table.insert(ready, name)
+                table.insert(waits, now - since)
+            else
+                redis.call('HSET', KEYS[2], name, version .. ':' .. seen .. ':' .. since)
+                has_pending = true
+            end
+        end
+    end
+    for _, name in ipairs(redis.call('HKEYS', key)) do
+        if not names[name] then
+            redis.call('HDEL', key, name)
+        end
+    end
+    -- Бакет с нестабильными файлами пересылается на каждом сканировании
+    if has_pending or count == 0 then
+        redis.call('HDEL', KEYS[1], bucket)
+    else
+        redis.call('HSET', KEYS[1], bucket, digest)
+    end
+    redis.call('EXPIRE', key, ttl)
+    k = k + 1
+end
+for _, name in ipairs(redis.call('HKEYS', KEYS[2])) do
+    if not current[name] then
+        redis.call('HDEL', KEYS[2], name)
+    end
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('EXPIRE', KEYS[2], ttl)
+return {ready, redis.call('HLEN', KEYS[2]), waits}
+"""
+
+
+# Компактный кеш листингов директорий в Redis с вычислением разницы на стороне сервера.
+# Листинг делится на бакеты по имени файла; в Redis уходят только бакеты,
+# дайджест которых изменился с прошлого сканирования.
+class ScanCache:
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._fetch = redis.register_script(FETCH_SCRIPT)
+        self._diff = redis.register_script(DIFF_SCRIPT)
+        self._touch = redis.register_script(TOUCH_SCRIPT)
+
+    @staticmethod
+    def _version(size: int, mtime) -> bytes:
+        # 16 байт вместо JSON: размер и время изменения
+        return struct.pack(">Qq", size, int(mtime or 0))
+
+    @staticmethod
+    def _bucket(filename: str) -> bytes:
+        return str(zlib.crc32(filename.encode()) % BUCKETS).encode()
+
+    def _migrate_legacy(self, host: str, path: str, prefix: str) -> None:
+        # Переносим уже отправленные файлы из JSON-кеша прежнего формата
+        legacy_key = f"{host}:{path}"
+        legacy = self.redis.hgetall(legacy_key)
+        if not legacy:
+            return
+        pipeline = self.redis.pipeline(transaction=False)
+        for name, value in legacy.items():
+            entry = json.loads(value)
+            if entry.get("sent", True):
+                bucket_key = f"{prefix}:{self._bucket(name.decode()).decode()}"
+                pipeline.hset(bucket_key, name, self._version(entry["size"], entry["mtime"]))
+                pipeline.expire(bucket_key, CACHE_TTL)
+        pipeline.delete(legacy_key)
+        pipeline.execute()
+        logger.info(f"💾 Кеш {legacy_key} перенесен в новый формат: {len(legacy)} файлов")
+
+    def touch(self, host: str, paths: list, pipeline=None) -> None:
+        """Продлевает кеш директорий, пропущенных при сканировании без изменений.
+
+        Иначе через CACHE_TTL кеш истечет, и при следующем изменении
+        директории все ее файлы будут отправлены повторно.
+        """
+        for path in paths:
+            prefix = f"scan:{host}:{path}"
+            self._touch(keys=[f"{prefix}:digests"], args=[prefix, CACHE_TTL], client=pipeline)
+
+    def get_ready_files(self, host: str, path: str, files: list) -> tuple[list, int]:
+        prefix = f"scan:{host}:{path}"
+        buckets = defaultdict(list)
+        for file in files:
+            buckets[self._bucket(file.filename)].append(
+                (file.filename.encode(), self._version(file.st_size, file.st_mtime))
+            )
+        digests = {
+            bucket: hashlib.sha1(
+                b"".join(name + b"\0" + version for name, version in sorted(entries))
+            ).digest()
+            for bucket, entries in buckets.items()
+        }
+
+        stored = self._fetch(keys=[f"{prefix}:digests"], args=[prefix, CACHE_TTL])
+        stored = dict(zip(stored[::2], stored[1::2]))
+        if not stored:
+            self._migrate_legacy(host, path, prefix)
+
+        changed = [
+            bucket
+            for bucket in set(digests) | set(stored)
+            if digests.get(bucket) != stored.get(bucket)
+        ]
+        if not changed:
+            # Бакеты с нестабильными файлами всегда считаются изменившимися
+            logger.debug(f"🔍 Кеш {prefix}: изменений нет")
+            return [], 0
+
+        keys = [f"{prefix}:digests", f"{prefix}:pending"]
+        args = [
+            int(time.time()),
+            settings.STABLE_SCANS,
+            settings.STABLE_QUIET_PERIOD,
+            CACHE_TTL,
+        ]
+        for bucket in changed:
+            keys.append(f"{prefix}:{bucket.decode()}")
+            args += [bucket, digests.get(bucket, b""), len(buckets[bucket])]
+            for name, version in buckets[bucket]:
+                args += [name, version]
+        ready, pending, waits = self._diff(keys=keys, args=args)
+        ready = {name.decode(): wait for name, wait in zip(ready, waits)}
+        logger.debug(
+            f"💾 Кеш {prefix}: изменилось бакетов {len(changed)}/{len(digests)}, готово файлов {len(ready)}, ожидают {pending}"
+        )
+        stable_files = [file for file in files if file.filename in ready]
+        for file in stable_files:
+            # Время ожидания стабилизации нужно для метрик при отправке файла
+            file.stable_wait = ready[file.filename]
+        return stable_files, pending
@@ -0,0 +1,123 @@
+import threading
+from contextlib import contextmanager
+
+from loguru import logger
+from redis import Redis
+
+from ..config import settings
+
+SCHEDULE_KEY = "scan:schedule"  # ID сервера -> время следующего сканирования
+INTERVAL_KEY = "scan:interval"  # ID сервера -> текущий интервал сканирования (сек)
+
+# Захватывает серверы, срок сканирования которых наступил: срок сдвигается
+# на время аренды, чтобы сервер не взял другой воркер; пока сканирование
+# идет, аренда продлевается (ScanLease). Новые серверы
+# сканируются сразу, исчезнувшие из списка активных удаляются из расписания.
+# ARGV: время аренды, затем ID активных серверов.
+CLAIM_SCRIPT = """
+local now = tonumber(redis.call('TIME')[1])
+local active, due = {}, {}
+for i = 2, #ARGV do
+    active[ARGV[i]] = true
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if not score or tonumber(score) <= now then
+        redis.call('ZADD', KEYS[1], now + tonumber(ARGV[1]), ARGV[i])
+        table.insert(due, ARGV[i])
+    end
+end
+for _, id in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    if not active[id] then
+        redis.call('ZREM', KEYS[1], id)
+        redis.call('HDEL', KEYS[2], id)
+    end
+end
+return due
+"""
+
+
+def lease_time() -> int:
+    return settings.SCAN_DEADLINE + settings.SCAN_TICK
+
+
+# Аренда серверов, сканируемых одним потоком. Каждые SCAN_TICK секунд
+# аренда еще не просканированных серверов продлевается, поэтому сервер,
+# сканирование которого не уложилось в дедлайн, не захватит другая проверка.
+# Продление и планирование следующего сканирования не пересекаются:
+# запоздавшее продление не перезапишет новое расписание.
+class ScanLease:
+    def __init__(self, schedule: "ScanSchedule", server_ids: list):
+        self.schedule = schedule
+        self._held = set(server_ids)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _renew(self) -> None:
+        while not self._stop.wait(settings.SCAN_TICK):
+            with self._lock:
+                if not self._held:
+                    continue
+                try:
+                    now = self.schedule.redis.time()[0]
+                    self.schedule.redis.zadd(
+                        SCHEDULE_KEY, {server_id: now + lease_time() for server_id in self._held}, xx=True
+                    )
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось продлить аренду серверов {sorted(self._held)}: {e}")
+
+    def complete(self, server, active: bool) -> int:
+        with self._lock:
+            self._held.discard(server.id)
+            return self.schedule.complete(server, active)
+
+
+# Расписание сканирования серверов, общее для всех воркеров сканирования.
+# Интервал сервера сбрасывается до минимального, когда сканирование нашло
+# новые или еще не стабилизировавшиеся файлы, и удваивается до максимального,
+# пока сервер простаивает или недоступен.
+class ScanSchedule:
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+
+    @staticmethod
+    def bounds(server) -> tuple[int, int]:
+        low = server.scan_min_interval or settings.SCAN_MIN_INTERVAL
+        high = server.scan_max_interval or settings.SCAN_MAX_INTERVAL
+        return low, max(low, high)
+
+    def claim_due(self, server_ids: list) -> list[int]:
+        due = self._claim(
+            keys=[SCHEDULE_KEY, INTERVAL_KEY],
+            args=[lease_time()] + list(server_ids),
+        )
+        return [int(server_id) for server_id in due]
+
+    @contextmanager
+    def hold(self, server_ids: list):
+        """Продлевает аренду серверов, пока они не отмечены через ScanLease.complete"""
+        lease = ScanLease(self, server_ids)
+        threading.Thread(target=lease._renew, daemon=True).start()
+        try:
+            yield lease
+        finally:
+            lease._stop.set()
+
+    def complete(self, server, active: bool) -> int:
+        """Планирует следующее сканирование сервера, возвращает интервал (сек)"""
+        low, high = self.bounds(server)
+        current = self.redis.hget(INTERVAL_KEY, server.id)
+        if active or current is None:
+            interval = low
+        else:
+            interval = min(high, max(low, int(float(current)) * 2))
+        now = self.redis.time()[0]
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.hset(INTERVAL_KEY, server.id, interval)
+        pipeline.zadd(SCHEDULE_KEY, {server.id: now + interval})
+        pipeline.execute()
+        return interval
+
+
+scan_schedule = ScanSchedule(
+    Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+)
@@ -1,14 +1,127 @@
 import json
+import math
+import os
+import threading
 import time
-from datetime import date
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from fnmatch import fnmatch
 from pathlib import Path
+from stat import S_ISDIR, S_ISREG
 
 from loguru import logger
-from paramiko import AutoAddPolicy
+from paramiko import AutoAddPolicy, SSHException
 from paramiko.client import SSHClient
+from paramiko.sftp import SFTPError
 from redis import Redis
 
 from ..config import settings
+from .checksum import TransferDigest, segment_alignment
+from .scan_cache import CACHE_TTL, ScanCache
+
+READ_CHUNK_SIZE = 1024 * 1024  # Размер блока чтения сегмента
+MAX_PREFETCH_REQUESTS = 128  # Ограничение запросов чтения "в полете" на один канал
+POOL_PING_AFTER = 30  # Простой (сек), после которого соединение из пула проверяется запросом
+PROGRESS_SAVE_INTERVAL = 32 * 1024 * 1024  # Объем (байт), после которого сегмент сохраняет прогресс
+
+
+def read_range(remote, offset: int, length: int, throttle=None):
+    # Конвейерное чтение диапазона удаленного файла блоками по READ_CHUNK_SIZE
+    chunks = [
+        (position, min(READ_CHUNK_SIZE, offset + length - position))
+        for position in range(offset, offset + length, READ_CHUNK_SIZE)
+    ]
+    for data in remote.readv(
+        chunks, max_concurrent_prefetch_requests=MAX_PREFETCH_REQUESTS
+    ):
+        if throttle:
+            throttle(len(data))
+        yield data
+
+
+# Поток чтения удаленного файла: данные запрашиваются только по мере чтения
+class SFTPStream:
+    def __init__(self, remote, size: int, throttle=None, digest: TransferDigest | None = None):
+        self.remote = remote
+        self.size = size
+        self.position = 0
+        self.throttle = throttle
+        self.hasher = digest.hasher(0) if digest else None
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = self.size - self.position
+        size = min(size, self.size - self.position)
+        if size <= 0:
+            return b""
+        data = b"".join(read_range(self.remote, self.position, size, self.throttle))
+        self.position += len(data)
+        if self.hasher:
+            self.hasher.update(data)
+        return data
+
+
+# Прогресс загрузки в .part-файл. Хранится рядом с ним в JSON и учитывает
+# только данные, уже сброшенные на диск: повтор продолжает с проверенного места.
+class DownloadProgress:
+    def __init__(self, part_file: str, size: int, mtime: int, segment_size: int):
+        self.part_file = part_file
+        self.record_file = f"{part_file}.json"
+        self.size = size
+        self.mtime = mtime
+        self.segment_size = segment_size
+        self.done = {}  # Смещение сегмента -> скачано байт
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, part_file: str, size: int, mtime: int, segment_size: int) -> "DownloadProgress":
+        progress = cls(part_file, size, mtime, segment_size)
+        try:
+            with open(progress.record_file) as f:
+                record = json.load(f)
+            # Прогресс годится, только если файл на сервере и разбиение на сегменты не изменились
+            if (
+                (record["size"], record["mtime"], record["segment_size"]) == (size, mtime, segment_size)
+                and os.path.getsize(part_file) == size
+            ):
+                progress.done = {int(offset): done for offset, done in record["done"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+        if not progress.done:
+            # Резервируем файл целиком, сегменты пишутся по своим смещениям
+            with open(part_file, "wb") as local:
+                local.truncate(size)
+            progress.save()
+        return progress
+
+    def commit(self, local, offset: int, done: int) -> None:
+        local.flush()
+        os.fsync(local.fileno())
+        with self._lock:
+            self.done[offset] = done
+            self.save()
+
+    def save(self) -> None:
+        tmp = f"{self.record_file}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "size": self.size,
+                    "mtime": self.mtime,
+                    "segment_size": self.segment_size,
+                    "done": self.done,
+                },
+                f,
+            )
+        os.replace(tmp, self.record_file)
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.record_file)
+        except FileNotFoundError:
+            pass
 
 
 # Сервис для мониторинга SFTP-серверов на наличие новых файлов
@@ -25,6 +138,8 @@ class SFTPService:
             port=settings.REDIS_PORT,
             db=settings.REDIS_DB,
         )
+        self.scan_cache = ScanCache(self.redis)
+        self.pending_files = 0  # Файлы, еще не ставшие стабильными, по всем сканированиям
 
     def connect(self):
         logger.debug(f"🔒 Подключение к SFTP {self.host}:{self.port}")
@@ -36,12 +151,21 @@ class SFTPService:
                 port=self.port,
                 username=self.username,
                 password=self.password,
+                timeout=settings.SFTP_CONNECT_TIMEOUT,
+                banner_timeout=settings.SFTP_CONNECT_TIMEOUT,
+                auth_timeout=settings.SFTP_CONNECT_TIMEOUT,
             )
-            self.sftp = self.client.open_sftp()
+            self.sftp = self.open_sftp()
             logger.info(f"✅ SFTP соединение с {self.host} установлено")
         except Exception as e:
             raise RuntimeError(f"Ошибка подключения к SFTP {self.host}: {e}")
 
+    def open_sftp(self):
+        # Зависшая операция на канале прерывается по таймауту, а не блокирует воркер
+        sftp = self.client.open_sftp()
+        sftp.get_channel().settimeout(settings.SFTP_TIMEOUT)
+        return sftp
+
     def disconnect(self) -> None:
         logger.debug(f"🔒 Отключение от SFTP {self.host}")
         try:
@@ -53,44 +177,15 @@ class SFTPService:
         except Exception as e:
             raise RuntimeError(f"Ошибка при отключении от SFTP {self.host}: {e}")
 
-    def _get_cached_files(self, host: str, path: str) -> dict:
-        key = f"{host}:{path}"
-        cache_data = self.redis.hgetall(key)
-        if cache_data:
-            result = {k.decode(): json.loads(v) for k, v in cache_data.items()}
-            logger.debug(f"🔍 Кеш найден для {key}: {len(result)} файлов")
-            return result
-        logger.debug(f"🔍 Кеш не найден для {key}")
-        return {}
-
-    def _save_files_to_cache(self, host: str, path: str, files: list) -> None:
-        key = f"{host}:{path}"
-        files_to_save = {
-            file.filename: json.dumps({"size": file.st_size, "mtime": file.st_mtime})
-            for file in files
-        }
-        if files_to_save:
-            self.redis.hset(key, mapping=files_to_save)
-            # Устанавливаем TTL для кеша (7 дней)
-            self.redis.expire(key, 604800)
-            logger.debug(f"💾 Кеш обновлен для {key}: {len(files_to_save)} файлов")
-
-    def _get_new_or_changed_files(self, files: list, cached_files: dict) -> list:
-        new_or_changed_files = []
-        for file in files:
-            cached = cached_files.get(file.filename)
-            if (
-                not cached
-                or cached["size"] != file.st_size
-                or cached["mtime"] != file.st_mtime
-            ):
-                new_or_changed_files.append(file)
-
-        if new_or_changed_files:
-            logger.debug(
-                f"🆕 Обнаружены изменения в {len(new_or_changed_files)} файлах"
-            )
-        return new_or_changed_files
+    def _scan_listing(self, path: str, files: list) -> tuple[list, int]:
+        # Пустой листинг тоже сверяется с кешем, чтобы удалить исчезнувшие файлы
+        stable_files, pending = self.scan_cache.get_ready_files(self.host, path, files)
+        self.pending_files += pending
+        if stable_files:
+            logger.info(f"🆕 {len(stable_files)} новых стабильных файлов в {path}")
+        else:
+            logger.info(f"✅ Нет файлов, готовых к загрузке, в {path}")
+        return stable_files, pending
 
     def scan_directory(self, path: str) -> list:
         if not self.sftp:
@@ -100,28 +195,108 @@ class SFTPService:
 
         logger.info(f"🔍 Сканирование {self.host}:{path}")
         try:
-            files = self.sftp.listdir_attr(path)
+            files = [
+                file for file in self.sftp.listdir_attr(path) if S_ISREG(file.st_mode)
+            ]
             if not files:
                 logger.info(f"📂 Директория {path} пуста")
-                return []
+            else:
+                logger.debug(f"📊 Найдено {len(files)} файлов в {path}")
+            stable_files, _ = self._scan_listing(path, files)
+            return stable_files
+        except Exception as e:
+            raise RuntimeError(f"Ошибка сканирования {self.host}:{path}: {e}")
 
-            logger.debug(f"📊 Найдено {len(files)} файлов в {path}")
-            cached_files = self._get_cached_files(self.host, path)
+    @staticmethod
+    def _matches(name: str, relative: str, patterns: list) -> bool:
+        return any(fnmatch(name, p) or fnmatch(relative, p) for p in patterns)
 
-            if cached_files:
-                new_files = self._get_new_or_changed_files(files, cached_files)
-                if new_files:
-                    logger.info(f"🆕 {len(new_files)} новых/измененных файлов в {path}")
+    def scan_tree(
+        self,
+        root: str,
+        max_depth: int,
+        include: list | None = None,
+        exclude: list | None = None,
+    ) -> list[tuple[str, list]]:
+        """Рекурсивное сканирование: возвращает пары (директория, готовые файлы).
+
+        Директория, mtime которой не изменился с прошлого сканирования и в которой
+        нет файлов в ожидании стабилизации, не перечитывается: ее подкаталоги
+        берутся из кеша. Дозапись в уже загруженный файл не меняет mtime
+        директории, поэтому в таких поддеревьях она не обнаруживается.
+        Кешу доверяется, только если mtime директории старше прочитанного
+        листинга хотя бы на секунду: mtime хранится с точностью до секунды,
+        и файл, созданный в ту же секунду после листинга, его не меняет.
+        """
+        if not self.sftp:
+            raise RuntimeError(
+                f"SFTP соединение не установлено при сканировании {root}"
+            )
+
+        logger.info(f"🔍 Рекурсивное сканирование {self.host}:{root} (глубина {max_depth})")
+        root = root.rstrip("/") or "/"
+        dirs_key = f"scan:dirs:{self.host}:{root}"
+        try:
+            cached = {
+                k.decode(): json.loads(v) for k, v in self.redis.hgetall(dirs_key).items()
+            }
+            visited = {}
+            results = []
+            pruned = []
+            stack = [(root, 0)]
+            while stack:
+                path, depth = stack.pop()
+                mtime = self.sftp.stat(path).st_mtime
+                entry = cached.get(path)
+                if (
+                    entry
+                    and entry["mtime"] == mtime
+                    and not entry["pending"]
+                    and mtime < entry.get("listed_at", 0) - 1
+                ):
+                    pruned.append(path)
                 else:
-                    logger.info(f"✅ Нет изменений в {path}")
-                self._save_files_to_cache(self.host, path, files)
-                return new_files
-            else:
-                logger.info(f"🆕 Первое сканирование {path}: {len(files)} файлов")
-                self._save_files_to_cache(self.host, path, files)
-                return files
+                    listed_at = int(time.time())
+                    subdirs, files = [], []
+                    for attr in self.sftp.listdir_attr(path):
+                        relative = f"{path}/{attr.filename}"[len(root):].lstrip("/")
+                        if exclude and self._matches(attr.filename, relative, exclude):
+                            continue
+                        if S_ISDIR(attr.st_mode):
+                            subdirs.append(attr.filename)
+                        elif S_ISREG(attr.st_mode) and (
+                            not include or self._matches(attr.filename, relative, include)
+                        ):
+                            files.append(attr)
+                    stable_files, pending = self._scan_listing(path, files)
+                    if stable_files:
+                        results.append((path, stable_files))
+                    entry = {
+                        "mtime": mtime,
+                        "subdirs": subdirs,
+                        "pending": pending,
+                        "listed_at": listed_at,
+                    }
+                visited[path] = entry
+                if depth < max_depth:
+                    stack.extend(
+                        (f"{path.rstrip('/')}/{name}", depth + 1) for name in entry["subdirs"]
+                    )
+
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.delete(dirs_key)
+            pipeline.hset(
+                dirs_key, mapping={path: json.dumps(entry) for path, entry in visited.items()}
+            )
+            pipeline.expire(dirs_key, CACHE_TTL)
+            self.scan_cache.touch(self.host, pruned, pipeline)
+            pipeline.execute()
+            logger.info(
+                f"🌲 {self.host}:{root}: директорий {len(visited)}, пропущено без изменений {len(pruned)}"
+            )
+            return results
         except Exception as e:
-            raise RuntimeError(f"Ошибка сканирования {self.host}:{path}: {e}")
+            raise RuntimeError(f"Ошибка рекурсивного сканирования {self.host}:{root}: {e}")
 
     @staticmethod
     def sftp_attr_to_dict(file):
@@ -131,50 +306,272 @@ class SFTPService:
             "st_mtime": file.st_mtime,
         }
 
-    def get_local_path(self, host: str, remote_path: str) -> str:
+    def get_local_path(self, host: str, remote_path: str, mtime: float) -> str:
+        # Каталог определяется версией файла, а не днем скачивания: повтор задачи
+        # после полуночи продолжает тот же .part и освобождает тот же резерв
         local_path = (
             Path(settings.LOCAL_DOWNLOAD_PATH)
             / host
             / remote_path.lstrip("/")
-            / date.today().isoformat()
+            / datetime.fromtimestamp(mtime, timezone.utc).date().isoformat()
         )
         local_path.mkdir(parents=True, exist_ok=True)
         logger.debug(f"📁 Подготовлена директория для загрузки: {local_path}")
         return str(local_path)
 
-    def file_is_stable(self, path: str, file: dict, sleep: int = 10) -> bool:
+    def file_is_unchanged(self, path: str, file: dict) -> bool:
+        # Стабильность определяется сканером; здесь только сверяем версию файла без ожидания
         filename = file["filename"]
-        logger.debug(f"⏱️ Проверка стабильности файла {filename}")
         try:
-            first_stat = self.sftp.stat(f"{path}/{filename}")
-            time.sleep(sleep)
-            second_stat = self.sftp.stat(f"{path}/{filename}")
+            current = self.sftp.stat(f"{path}/{filename}")
             return (
-                first_stat.st_size == second_stat.st_size
-                and first_stat.st_mtime == second_stat.st_mtime
+                current.st_size == file["st_size"]
+                and current.st_mtime == file["st_mtime"]
             )
         except Exception as e:
-            raise RuntimeError(f"Ошибка проверки стабильности {filename}: {e}")
+            raise RuntimeError(f"Ошибка проверки файла {filename}: {e}")
+
+    def _download_segment(
+        self,
+        remote_file: str,
+        progress: DownloadProgress,
+        offset: int,
+        length: int,
+        throttle=None,
+        sftp=None,
+        digest: TransferDigest | None = None,
+    ) -> None:
+        # Сегмент продолжается с последнего сохраненного смещения;
+        # без явно переданного канала читается через собственный SFTP-канал
+        done = progress.done.get(offset, 0)
+        hasher = digest.hasher(offset) if digest else None
+        if hasher and done:
+            # Уже скачанная часть сегмента дохешируется с локального диска
+            with open(progress.part_file, "rb") as local:
+                local.seek(offset)
+                for position in range(offset, offset + done, READ_CHUNK_SIZE):
+                    hasher.update(local.read(min(READ_CHUNK_SIZE, offset + done - position)))
+        if done >= length:
+            return
+        channel = sftp or self.open_sftp()
+        try:
+            with channel.open(remote_file, "rb") as remote, open(progress.part_file, "r+b") as local:
+                local.seek(offset + done)
+                unsaved = 0
+                for data in read_range(remote, offset + done, length - done, throttle):
+                    local.write(data)
+                    if hasher:
+                        hasher.update(data)
+                    done += len(data)
+                    unsaved += len(data)
+                    if unsaved >= PROGRESS_SAVE_INTERVAL:
+                        progress.commit(local, offset, done)
+                        unsaved = 0
+                progress.commit(local, offset, done)
+        finally:
+            if not sftp:
+                channel.close()
+
+    def _download_segmented(
+        self,
+        remote_file: str,
+        progress: DownloadProgress,
+        parallelism: int,
+        throttle=None,
+        digest: TransferDigest | None = None,
+    ) -> None:
+        segments = [
+            (offset, min(progress.segment_size, progress.size - offset))
+            for offset in range(0, progress.size, progress.segment_size)
+        ]
+        logger.debug(
+            f"🧩 {remote_file}: {len(segments)} сегментов, {parallelism} каналов"
+        )
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            futures = [
+                executor.submit(
+                    self._download_segment,
+                    remote_file,
+                    progress,
+                    offset,
+                    length,
+                    throttle,
+                    digest=digest,
+                )
+                for offset, length in segments
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    @contextmanager
+    def open_stream(
+        self, remote_path: str, file: dict, throttle=None, digest: TransferDigest | None = None
+    ):
+        if not self.sftp:
+            raise RuntimeError("SFTP соединение не установлено")
+        with self.sftp.open(f"{remote_path}/{file['filename']}", "rb") as remote:
+            yield SFTPStream(remote, file["st_size"], throttle, digest)
 
-    def download_file(self, remote_path: str, file: dict) -> bool:
+    def download_file(
+        self,
+        remote_path: str,
+        file: dict,
+        segment_threshold: int | None = None,
+        segment_size: int | None = None,
+        segment_parallelism: int | None = None,
+        throttle=None,
+        digest: TransferDigest | None = None,
+    ) -> bool:
         if not self.sftp:
             raise RuntimeError("SFTP соединение не установлено")
         filename = file["filename"]
+        segment_threshold = segment_threshold or settings.SFTP_SEGMENT_THRESHOLD
+        segment_size = segment_size or settings.SFTP_SEGMENT_SIZE
+        segment_parallelism = segment_parallelism or settings.SFTP_SEGMENT_PARALLELISM
         try:
-            local_path = self.get_local_path(self.host, remote_path)
-            if not self.file_is_stable(path=remote_path, file=file):
-                logger.warning(f"⚠️ Файл {filename} нестабилен, пропускаем")
-                return False
+            local_path = self.get_local_path(self.host, remote_path, file["st_mtime"])
             logger.info(
                 f"⬇️ Загрузка: {remote_path}/{filename} → {local_path}/{filename}"
             )
-            self.sftp.get(
-                remotepath=f"{remote_path}/{filename}",
-                localpath=f"{local_path}/{filename}",
+            size = file["st_size"]
+            segmented = size >= segment_threshold and segment_parallelism > 1
+            if segmented and digest:
+                alignment = segment_alignment(size)
+                segment_size = math.ceil(segment_size / alignment) * alignment
+            local_file = f"{local_path}/{filename}"
+            progress = DownloadProgress.load(
+                f"{local_file}.part",
+                size,
+                file["st_mtime"],
+                segment_size if segmented else max(size, 1),
             )
+            if progress.done:
+                logger.info(
+                    f"⏯️ Продолжение загрузки {filename} с {sum(progress.done.values())/1024/1024:.2f} МБ"
+                )
+            if segmented:
+                self._download_segmented(
+                    remote_file=f"{remote_path}/{filename}",
+                    progress=progress,
+                    parallelism=segment_parallelism,
+                    throttle=throttle,
+                    digest=digest,
+                )
+            else:
+                self._download_segment(
+                    f"{remote_path}/{filename}",
+                    progress,
+                    0,
+                    size,
+                    throttle,
+                    sftp=self.sftp,
+                    digest=digest,
+                )
+            # Файл появляется под своим именем только полностью скачанным
+            os.replace(progress.part_file, local_file)
+            progress.remove()
             logger.info(
                 f"✅ Загружен файл {filename} ({file['st_size']/1024/1024:.2f} МБ)"
             )
             return True
         except Exception as e:
             raise RuntimeError(f"Ошибка загрузки {filename}: {e}")
+
+
+# Ошибки, после которых состояние SSH-сессии или SFTP-канала не гарантировано
+CONNECTION_ERRORS = (SSHException, SFTPError, OSError, EOFError)
+
+
+def is_connection_error(error: BaseException) -> bool:
+    # Ошибки SFTP оборачиваются в RuntimeError: проверяется вся цепочка причин
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, CONNECTION_ERRORS):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# Пул живых SFTP-соединений процесса воркера, ключ — (host, port, username)
+class SFTPPool:
+    def __init__(self):
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _is_healthy(self, service: SFTPService, idle_since: float) -> bool:
+        transport = service.client.get_transport()
+        if not transport or not transport.is_active():
+            return False
+        if time.monotonic() - idle_since >= POOL_PING_AFTER:
+            try:
+                service.sftp.stat(".")
+            except Exception:
+                return False
+        return True
+
+    @staticmethod
+    def _close(service: SFTPService) -> None:
+        try:
+            service.disconnect()
+        except Exception as e:
+            logger.warning(f"⚠️ {e}")
+
+    def _acquire(self, key: tuple, password: str) -> SFTPService:
+        while True:
+            with self._lock:
+                # Соединения, унаследованные от родительского процесса, не используем
+                if self._pid != os.getpid():
+                    self._idle = defaultdict(list)
+                    self._pid = os.getpid()
+                if not self._idle[key]:
+                    break
+                service, idle_since = self._idle[key].pop()
+            if time.monotonic() - idle_since > settings.SFTP_POOL_IDLE_TIMEOUT:
+                self._close(service)
+            elif self._is_healthy(service, idle_since):
+                return service
+            else:
+                logger.debug(f"♻️ Соединение с {service.host} из пула неактивно, закрываем")
+                self._close(service)
+        host, port, username = key
+        service = SFTPService(host, port, username, password)
+        service.connect()
+        return service
+
+    def _release(self, key: tuple, service: SFTPService) -> None:
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle[key]) < settings.SFTP_POOL_MAX_IDLE:
+                self._idle[key].append((service, time.monotonic()))
+                return
+        self._close(service)
+
+    @contextmanager
+    def lease(self, host: str, port: int, username: str, password: str):
+        key = (host, int(port), username)
+        service = self._acquire(key, password)
+        try:
+            yield service
+        except Exception as e:
+            # После ошибки соединения состояние канала не гарантировано — соединение
+            # не возвращаем. Прикладные ошибки (нет слота, нет места в промежуточном
+            # каталоге) соединение не затрагивают, и оно возвращается в пул
+            if is_connection_error(e):
+                self._close(service)
+            else:
+                self._release(key, service)
+            raise
+        except BaseException:
+            self._close(service)
+            raise
+        else:
+            self._release(key, service)
+
+
+sftp_pool = SFTPPool()
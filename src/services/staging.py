@@ -0,0 +1,210 @@
+import os
+import shutil
+import time
+
+from loguru import logger
+from redis import Redis
+
+from ..config import settings
+from .limits import SlotUnavailable
+
+RESERVATIONS_KEY = "staging:reservations"  # Путь файла -> "размер:время резерва"
+EXPIRY_KEY = "staging:expiry"  # Путь файла -> срок действия резерва
+USED_KEY = "staging:used"  # Сумма зарезервированных байт
+PART_SUFFIXES = (".part.json.tmp", ".part.json", ".part")  # Файлы незавершенного скачивания
+
+# Освобождает просроченные резервы; общая часть скриптов
+EXPIRE = """
+local now = tonumber(redis.call('TIME')[1])
+for _, path in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    local entry = redis.call('HGET', KEYS[1], path)
+    if entry then
+        redis.call('DECRBY', KEYS[3], string.match(entry, '^(%d+)'))
+        redis.call('HDEL', KEYS[1], path)
+    end
+    redis.call('ZREM', KEYS[2], path)
+end
+"""
+
+# Резервирует ARGV[2] байт под файл ARGV[1], если не превышена квота ARGV[3]
+# и резервы помещаются на диск: ARGV[5] — место, доступное под все резервы
+# (свободное место плюс уже записанные байты резервов) за вычетом STAGING_MIN_FREE.
+# Возвращает 1, 0 при исчерпанной квоте и -1 при нехватке места на диске.
+# Повторный резерв того же файла (повтор задачи) ограничения не проверяет.
+RESERVE_SCRIPT = (
+    EXPIRE
+    + """
+local size, quota, budget = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[5])
+local entry = redis.call('HGET', KEYS[1], ARGV[1])
+local used = tonumber(redis.call('GET', KEYS[3]) or '0')
+if entry then
+    used = used - tonumber(string.match(entry, '^(%d+)'))
+-- Файл больше квоты скачивается, только когда каталог пуст
+elseif quota > 0 and used > 0 and used + size > quota then
+    return 0
+elseif used + size > budget then
+    return -1
+end
+redis.call('SET', KEYS[3], used + size)
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ':' .. now)
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[4]), ARGV[1])
+return 1
+"""
+)
+
+RELEASE_SCRIPT = """
+local entry = redis.call('HGET', KEYS[1], ARGV[1])
+if not entry then
+    return 0
+end
+redis.call('DECRBY', KEYS[3], string.match(entry, '^(%d+)'))
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+class StagingFull(SlotUnavailable):
+    """В промежуточном каталоге нет места под файл"""
+
+
+# Учет места в LOCAL_DOWNLOAD_PATH, общий для всех воркеров: каталог
+# смонтирован во все контейнеры, поэтому резервы хранятся в Redis.
+# Место резервируется по размеру файла до скачивания и освобождается
+# после загрузки в MinIO вместе с удалением файла.
+class StagingArea:
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._reserve = redis.register_script(RESERVE_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._expire = redis.register_script(EXPIRE + "\nreturn 1")
+        self.keys = [RESERVATIONS_KEY, EXPIRY_KEY, USED_KEY]
+
+    @staticmethod
+    def _path(path: str) -> str:
+        # Пути сравниваются с найденными при обходе каталога
+        return os.path.abspath(path)
+
+    def _written(self) -> int:
+        """Байты, уже записанные на диск под действующие резервы"""
+        written = 0
+        for path, entry in self.redis.hgetall(RESERVATIONS_KEY).items():
+            allocated = 0
+            for suffix in ("", ".part"):
+                try:
+                    # Файл сегментной загрузки создается разреженным: считаются занятые блоки
+                    allocated += os.stat(f"{path.decode()}{suffix}").st_blocks * 512
+                except FileNotFoundError:
+                    pass
+            written += min(allocated, int(entry.split(b":")[0]))
+        return written
+
+    def reserve(self, path: str, size: int) -> None:
+        """Резервирует место под файл или бросает StagingFull.
+
+        Незаписанная часть резервов вычитается из свободного места на диске:
+        одновременно начатые загрузки не должны вместе переполнить диск.
+        """
+        root = settings.LOCAL_DOWNLOAD_PATH
+        os.makedirs(root, exist_ok=True)
+        free = shutil.disk_usage(root).free
+
+        def attempt(written: int) -> int:
+            return self._reserve(
+                keys=self.keys,
+                args=[
+                    self._path(path),
+                    size,
+                    settings.STAGING_QUOTA,
+                    settings.STAGING_RESERVATION_TTL,
+                    free + written - settings.STAGING_MIN_FREE,
+                ],
+            )
+
+        # Сначала резервы считаются незаписанными целиком; точный подсчет
+        # записанных байт нужен, только если так места не хватило
+        reserved = attempt(0)
+        if reserved == -1:
+            written = self._written()
+            reserved = attempt(written)
+            if reserved == -1:
+                pending = (self.used() - written) / 1024 / 1024
+                raise StagingFull(
+                    f"На диске свободно {free / 1024 / 1024:.0f} МБ, "
+                    f"но {pending:.0f} МБ из них нужны начатым загрузкам"
+                )
+        if not reserved:
+            raise StagingFull(f"Квота промежуточного каталога {settings.STAGING_QUOTA} байт исчерпана")
+
+    def release(self, path: str) -> None:
+        self._release(keys=self.keys, args=[self._path(path)])
+
+    def remove(self, path: str) -> None:
+        """Удаляет файл и остатки незавершенного скачивания, освобождает резерв"""
+        # Ошибка очистки только логируется: оставшееся удалит sweep
+        try:
+            for suffix in ("",) + PART_SUFFIXES:
+                try:
+                    os.remove(f"{path}{suffix}")
+                except FileNotFoundError:
+                    pass
+            self.release(path)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось удалить {path} из промежуточного каталога: {e}")
+
+    def used(self) -> int:
+        return int(self.redis.get(USED_KEY) or 0)
+
+    def sweep(self) -> dict:
+        """Удаляет файлы без резерва старше STAGING_ORPHAN_AGE и резервы без файлов.
+
+        Такие файлы и резервы остаются после задач, упавших между
+        скачиванием и загрузкой в MinIO.
+        """
+        stats = {"files": 0, "bytes": 0, "reservations": 0}
+        root = self._path(settings.LOCAL_DOWNLOAD_PATH)
+        if not os.path.isdir(root):
+            return stats
+        self._expire(keys=self.keys)
+        reserved = {path.decode(): entry for path, entry in self.redis.hgetall(RESERVATIONS_KEY).items()}
+        cutoff = time.time() - settings.STAGING_ORPHAN_AGE
+        for directory, _, filenames in os.walk(root, topdown=False):
+            for name in filenames:
+                path = os.path.join(directory, name)
+                staged = next(
+                    (path[: -len(suffix)] for suffix in PART_SUFFIXES if path.endswith(suffix)), path
+                )
+                if staged in reserved:
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime > cutoff:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                stats["files"] += 1
+                stats["bytes"] += stat.st_size
+            try:
+                if directory != root and os.stat(directory).st_mtime < cutoff:
+                    os.rmdir(directory)
+            except OSError:
+                pass  # Каталог не пуст
+        for path, entry in reserved.items():
+            reserved_at = int(entry.split(b":")[1])
+            if reserved_at < cutoff and not any(
+                os.path.exists(f"{path}{suffix}") for suffix in ("",) + PART_SUFFIXES
+            ):
+                self.release(path)
+                stats["reservations"] += 1
+        if any(stats.values()):
+            logger.info(
+                f"🧹 Промежуточный каталог: удалено {stats['files']} файлов "
+                f"({stats['bytes'] / 1024 / 1024:.2f} МБ), снято {stats['reservations']} резервов"
+            )
+        return stats
+
+
+staging = StagingArea(
+    Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+)
@@ -1,64 +1,289 @@
 import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
 from typing import Optional
 
+from celery.signals import worker_process_shutdown, worker_shutdown
 from loguru import logger
 from pydantic import BaseModel
+from redis import Redis
 
-from ..database import async_session_maker
-from ..manager.crud import FileDAO
+from ..celery_app import size_lane
+from ..config import settings
+from ..database import async_session_maker, engine
+from ..manager.crud import FileDAO, OutboxDAO, ServerDAO
+from ..manager.events import STATUS_CHANNEL
+from ..manager.models import FileStatus
+from ..manager.schemas import FileSchema, ServerSchema
+from ..services.metrics import DB_WRITE_DURATION, STATUS_DURATION, metrics_pipeline
+
+SERVER_CACHE_TTL = 3600  # TTL (сек) параметров сервера в кеше для воркеров
+STATUS_SINCE_TTL = 86400  # TTL (сек) времени последнего перехода статуса файла для метрик
+
+redis = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=settings.REDIS_DB)
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def run_async(coro):
+    """Выполняет корутину в фоновом event loop процесса воркера.
+
+    Один loop на процесс позволяет переиспользовать пул соединений с БД
+    вместо asyncio.run() на каждый вызов.
+    """
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop_pid != os.getpid():
+            # Соединения, унаследованные от родительского процесса, не используем
+            engine.sync_engine.dispose(close=False)
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+            _loop_pid = os.getpid()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+def cache_servers(servers: list) -> None:
+    """Сохраняет параметры серверов в Redis, чтобы задачи передавали только ID сервера"""
+    pipeline = redis.pipeline(transaction=False)
+    for server in servers:
+        pipeline.set(
+            f"server:{server.id}",
+            ServerSchema.model_validate(server, from_attributes=True).model_dump_json(),
+            ex=SERVER_CACHE_TTL,
+        )
+    pipeline.execute()
+
+
+def get_server(server_id: int) -> ServerSchema:
+    """Параметры сервера из кеша Redis, при промахе — из базы данных"""
+    cached = redis.get(f"server:{server_id}")
+    if cached:
+        return ServerSchema.model_validate_json(cached)
+
+    async def inner():
+        async with async_session_maker() as session:
+            return await ServerDAO().find_one_or_none_by_id(session=session, data_id=server_id)
+
+    server = run_async(inner())
+    if not server:
+        raise RuntimeError(f"Сервер с ID {server_id} не найден")
+    cache_servers([server])
+    return ServerSchema.model_validate(server, from_attributes=True)
 
 
 class DownloadedFile(BaseModel):
     server_id: int
+    remote_path: str
     filename: str
-    size: float
+    size: int
 
 
 class DownloadedFileUpdateStatus(DownloadedFile):
     status: str
     minio_path: Optional[str] = None
     error_message: Optional[str] = None
+    checksum: Optional[str] = None
+    deduplicated: Optional[bool] = None
+
 
+def outbox_messages(batch: list[DownloadedFileUpdateStatus]) -> list[dict]:
+    """Уведомления о файлах пачки, загруженных в MinIO"""
+    if not settings.AMQP_URL:
+        return []
+    return [
+        {
+            "routing_key": settings.AMQP_ROUTING_KEY,
+            "payload": data.model_dump_json(
+                include={
+                    "server_id",
+                    "remote_path",
+                    "filename",
+                    "size",
+                    "minio_path",
+                    "checksum",
+                    "deduplicated",
+                }
+            ),
+        }
+        for data in batch
+        if data.status == FileStatus.DOWNLOADED_TO_MINIO.value
+    ]
+
+
+def write_statuses(batch: list[DownloadedFileUpdateStatus]) -> list:
+    """Записывает пачку статусов, возвращает записанные строки файлов"""
 
-def update_file_status(data: DownloadedFileUpdateStatus):
     async def inner():
         async with async_session_maker() as session:
             try:
-                await FileDAO().upsert_file(
-                    session=session,
-                    filters=DownloadedFile(
-                        server_id=data.server_id,
-                        filename=data.filename,
-                        size=data.size,
-                    ),
-                    values=data,
-                )
+                rows = await FileDAO().upsert_many(session=session, values=batch)
+                # Уведомления фиксируются вместе со статусом и не теряются, если воркер упадет
+                await OutboxDAO().add_many(session=session, values=outbox_messages(batch))
                 await session.commit()
-            except Exception as e:
-                logger.error(
-                    f"Ошибка при обновлении статуса файла {data.filename}: {e}"
-                )
+                return rows
+            except Exception:
                 await session.rollback()
-                return False
+                raise
+
+    started = time.monotonic()
+    rows = run_async(inner())
+    DB_WRITE_DURATION.observe(time.monotonic() - started)
+    return rows
+
 
-    asyncio.run(inner())
+def publish_statuses(rows: list) -> None:
+    """Публикует записанные статусы для веб-интерфейса одним сообщением на пачку"""
+    try:
+        files = [FileSchema.model_validate(row, from_attributes=True).model_dump() for row in rows]
+        redis.publish(STATUS_CHANNEL, json.dumps(files))
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось опубликовать статусы файлов: {str(e)}")
+
+
+def observe_status_durations(transitions: dict) -> None:
+    """Время, проведенное файлами в статусах, по переходам из пачки.
+
+    Последний переход каждого файла сохраняется в Redis, чтобы время
+    считалось и между пачками разных процессов (скачивание и загрузка).
+    """
+    try:
+        pipeline = redis.pipeline(transaction=False)
+        for (server_id, remote_path, filename, size), changes in transitions.items():
+            key = f"metrics:status_since:{server_id}:{remote_path}/{filename}:{size}"
+            status, at = changes[-1]
+            if status == FileStatus.DOWNLOADED_TO_MINIO.value:
+                pipeline.getdel(key)
+            else:
+                pipeline.set(key, f"{status}:{at}", ex=STATUS_SINCE_TTL, get=True)
+        previous = pipeline.execute()
+        with metrics_pipeline() as metrics:
+            for ((server_id, _, _, size), changes), last in zip(transitions.items(), previous):
+                if last:
+                    status, at = last.decode().rsplit(":", 1)
+                    changes = [(status, float(at))] + changes
+                for (status, at), (_, next_at) in zip(changes, changes[1:]):
+                    STATUS_DURATION.observe(
+                        next_at - at, metrics, server=server_id, size=size_lane(size), status=status
+                    )
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сохранить время статусов файлов: {str(e)}")
+
+
+class StatusWriter:
+    """Буфер статусов файлов процесса воркера.
+
+    Переходы статусов одного файла схлопываются до последнего, буфер
+    сбрасывается в БД одним upsert раз в STATUS_FLUSH_INTERVAL секунд,
+    при наполнении до STATUS_BATCH_SIZE или по требованию.
+    """
+
+    def __init__(self):
+        self._buffer = {}
+        self._transitions = defaultdict(list)  # Переходы статусов с момента прошлого сброса
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+
+    def put(self, data: DownloadedFileUpdateStatus, flush: bool = False, strict: bool = False) -> None:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._buffer = {}
+                self._transitions = defaultdict(list)
+                if settings.STATUS_FLUSH_INTERVAL > 0:
+                    threading.Thread(target=self._flush_periodically, daemon=True).start()
+            key = (data.server_id, data.remote_path, data.filename, data.size)
+            self._buffer[key] = data
+            self._transitions[key].append((data.status, time.time()))
+            full = len(self._buffer) >= settings.STATUS_BATCH_SIZE
+        if flush or full or settings.STATUS_FLUSH_INTERVAL <= 0:
+            self.flush(strict=strict)
+
+    def flush(self, strict: bool = False) -> None:
+        """Записывает буфер в БД; при strict ошибка записи передается вызывающему"""
+        # Сбросы сериализованы, чтобы более поздний статус не был перезаписан более ранним
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, {}
+                transitions, self._transitions = self._transitions, defaultdict(list)
+            if not batch:
+                return
+            observe_status_durations(transitions)
+            try:
+                rows = write_statuses(list(batch.values()))
+            except Exception as e:
+                logger.error(f"Ошибка при записи {len(batch)} статусов файлов: {e}")
+                with self._lock:
+                    # Возвращаем пачку в буфер, не затирая более новые статусы
+                    for key, data in batch.items():
+                        self._buffer.setdefault(key, data)
+                if strict:
+                    raise
+                return
+            # Публикуются только записанные статусы: страница, перечитанная из БД, с ними согласована
+            publish_statuses(rows)
+
+    def _flush_periodically(self) -> None:
+        while True:
+            time.sleep(settings.STATUS_FLUSH_INTERVAL)
+            self.flush()
+
+
+status_writer = StatusWriter()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_statuses_on_shutdown(**kwargs):
+    status_writer.flush()
+
+
+def update_file_status(
+    data: DownloadedFileUpdateStatus, flush: bool = False, strict: bool = False
+):
+    status_writer.put(data, flush=flush, strict=strict)
 
 
 def set_status(
     server_id: int,
+    remote_path: str,
     filename: str,
     size: float,
     status: str,
     minio_path: Optional[str] = None,
-    error_message: Optional[str] = None
+    error_message: Optional[str] = None,
+    checksum: Optional[str] = None,
+    deduplicated: Optional[bool] = None,
 ) -> None:
     update_file_status(
         DownloadedFileUpdateStatus(
             server_id=server_id,
+            remote_path=remote_path,
             filename=filename,
             size=size,
             status=status,
             minio_path=minio_path,
             error_message=error_message,
-        )
+            checksum=checksum,
+            deduplicated=deduplicated,
+        ),
+        # Итоговые статусы записываются сразу, до подтверждения задачи.
+        # DOWNLOADED_TO_SERVER — тоже: следующий статус файла пишет воркер
+        # загрузки, и запоздавший сброс не должен его перезаписать
+        flush=status
+        in (
+            FileStatus.DOWNLOADED_TO_SERVER.value,
+            FileStatus.DOWNLOADED_TO_MINIO.value,
+            FileStatus.ERROR.value,
+        ),
+        # Задача не продолжается, пока эти статусы не записаны: иначе после
+        # падения воркера пропадут статус и уведомление в outbox, а файл в
+        # промежуточном каталоге уже будет удален. Ошибка записи приводит к повтору задачи
+        strict=status
+        in (FileStatus.DOWNLOADED_TO_SERVER.value, FileStatus.DOWNLOADED_TO_MINIO.value),
     )
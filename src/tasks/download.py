@@ -1,106 +1,265 @@
+import random
+import time
 from datetime import date
 
 from loguru import logger
 
-from ..celery_app import celery
-from ..manager.crud import FileDAO
+from ..celery_app import celery, download_queue, size_lane, upload_queue
+from ..config import settings
 from ..manager.models import FileStatus
-from ..services.sftp import SFTPService
-from .crud import set_status
-from .upload import upload_file_to_minio
+from ..manager.schemas import ServerSchema
+from ..services.checksum import TransferDigest
+from ..services.dedup import DuplicateTransfer, file_dedup
+from ..services.limits import SlotUnavailable, server_limits
+from ..services.metrics import (
+    TRANSFER_DURATION,
+    TRANSFER_THROUGHPUT,
+    TRANSFERRED_BYTES,
+    metrics_pipeline,
+)
+from ..services.minio import MinioClient
+from ..services.sftp import sftp_pool
+from ..services.staging import staging
+from .crud import get_server, set_status
+from .upload import report_minio_pool, upload_file_to_minio
 
 
-@celery.task(bind=True, max_retries=10)
-def download_file_task(
-    self,
-    host: str,
-    port: int,
-    username: str,
-    password: str,
-    remote_path: str,
-    file: dict,
-    server_id: int,
-):
-    filename = file.get("filename", "неизвестный файл")
-    file_size_byte = file.get("st_size", 0)
+def file_from_descriptor(descriptor: list) -> dict:
+    # Файл передается в сообщении компактно: [имя, размер, mtime]
+    filename, size, mtime = descriptor
+    return {"filename": filename, "st_size": size, "st_mtime": mtime}
+
+
+def observe_transfer(server_id: int, size: int, elapsed: float) -> None:
+    lane = size_lane(size)
+    with metrics_pipeline() as pipeline:
+        TRANSFER_DURATION.observe(elapsed, pipeline, server=server_id, size=lane)
+        TRANSFER_THROUGHPUT.observe(size / max(elapsed, 0.001), pipeline, server=server_id, size=lane)
+        TRANSFERRED_BYTES.inc(size, pipeline, server=server_id, size=lane)
+
+
+def transfer_file(server: ServerSchema, remote_path: str, file: dict) -> dict:
+    """Скачивает один файл; исключение означает, что нужна повторная попытка"""
+    host = server.host
+    filename = file["filename"]
+    file_size_byte = file["st_size"]
     file_size_mb = file_size_byte / 1024 / 1024
 
     logger.info(
         f"⬇️ Задача скачивания {filename} ({file_size_mb:.2f} МБ) с {host}:{remote_path}"
     )
-    set_status(server_id, filename, file_size_byte, FileStatus.NEW.value)
-
-    sftp_service = SFTPService(host, port, username, password)
     result = {
         "success": False,
         "filename": filename,
         "server": host,
         "path": remote_path,
         "size": file_size_byte,
-        "server_id": server_id,
+        "server_id": server.id,
     }
 
-    try:
-        sftp_service.connect()
-        logger.debug(f"🔌 Подключение к {host} установлено для загрузки {filename}")
+    throttle = server_limits.throttle(server.id, server.max_bandwidth)
+    with file_dedup.lease(server.id, remote_path, file) as lease, server_limits.transfer_slot(
+        server.id, server.max_transfers
+    ), sftp_pool.lease(host, server.port, server.username, server.password) as sftp_service:
+        local_file = f"{sftp_service.get_local_path(host, remote_path, file['st_mtime'])}/{filename}"
+        if not settings.STREAM_TO_MINIO:
+            # Место под файл резервируется до передачи; если его нет, задача откладывается
+            staging.reserve(local_file, file_size_byte)
+        # Статус пишется после аренды, чтобы дубликат не откатил статус переданного файла
+        set_status(server.id, remote_path, filename, file_size_byte, FileStatus.NEW.value)
+        logger.debug(f"🔌 Соединение с {host} получено из пула для загрузки {filename}")
 
-        if not sftp_service.file_is_stable(remote_path, file):
+        if not sftp_service.file_is_unchanged(remote_path, file):
+            # Новую версию файла сканер отправит сам, когда она стабилизируется
             logger.warning(
-                f"⚠️ Файл {filename} нестабилен, будет повторная попытка позже"
+                f"⚠️ Файл {filename} изменился после обнаружения, загрузка отменена"
             )
             set_status(
-                server_id,
+                server.id,
+                remote_path,
                 filename,
                 file_size_byte,
                 FileStatus.RETRY.value,
-                "Файл нестабилен",
+                error_message="Файл изменился после обнаружения",
             )
-            raise Exception("Файл нестабилен")
+            staging.remove(local_file)
+            return result
 
-        set_status(server_id, filename, file_size_byte, FileStatus.DOWNLOADING.value)
+        set_status(server.id, remote_path, filename, file_size_byte, FileStatus.DOWNLOADING.value)
 
-        if sftp_service.download_file(remote_path, file):
+        bucket_name = f"server-{host.replace('.', '-')}"
+        minio_path = f"{remote_path}/{date.today().isoformat()}/{filename}"
+        digest = TransferDigest(file_size_byte)
+        started = time.monotonic()
+
+        if settings.STREAM_TO_MINIO:
+            try:
+                with sftp_service.open_stream(remote_path, file, throttle, digest) as stream:
+                    MinioClient().upload_stream(
+                        bucket_name, minio_path, stream, file_size_byte, digest
+                    )
+            except Exception as e:
+                logger.warning(
+                    f"⚠️ Потоковая передача {filename} не удалась, загружаем через локальный диск: {str(e)}"
+                )
+                staging.reserve(local_file, file_size_byte)
+                digest = TransferDigest(file_size_byte)
+                started = time.monotonic()
+            else:
+                # Ошибка записи статуса не повод качать файл заново через диск: задача повторится
+                set_status(
+                    server.id,
+                    remote_path,
+                    filename,
+                    file_size_byte,
+                    FileStatus.DOWNLOADED_TO_MINIO.value,
+                    minio_path=f"{bucket_name}/{minio_path}",
+                    checksum=digest.hexdigest(),
+                    deduplicated=False,
+                )
+                result["success"] = True
+                lease.complete()
+                observe_transfer(server.id, file_size_byte, time.monotonic() - started)
+                logger.info(f"✅ Файл {filename} передан в MinIO потоком по пути {minio_path}")
+                report_minio_pool()
+                return result
+
+        if sftp_service.download_file(
+            remote_path,
+            file,
+            segment_threshold=server.segment_threshold,
+            segment_size=server.segment_size,
+            segment_parallelism=server.segment_parallelism,
+            throttle=throttle,
+            digest=digest,
+        ):
+            observe_transfer(server.id, file_size_byte, time.monotonic() - started)
+            checksum = digest.hexdigest()
             set_status(
-                server_id,
+                server.id,
+                remote_path,
                 filename,
                 file_size_byte,
                 FileStatus.DOWNLOADED_TO_SERVER.value,
+                checksum=checksum,
             )
             result["success"] = True
+            lease.complete()
             upload_file_to_minio.apply_async(
                 kwargs={
-                    "server_id": server_id,
+                    "server_id": server.id,
+                    "remote_path": remote_path,
                     "filename": filename,
                     "file_size_byte": file_size_byte,
-                    "local_path": f"{sftp_service.get_local_path(host, remote_path)}/{filename}",
-                    "minio_path": f"{remote_path}/{date.today().isoformat()}/{filename}",
-                    "bucket_name": f"server-{host.replace('.', '-')}",
+                    "local_path": local_file,
+                    "minio_path": minio_path,
+                    "bucket_name": bucket_name,
+                    "checksum": checksum,
+                    "etag": digest.etag(),
                 },
-                queue="upload_queue",
+                queue=upload_queue(file_size_byte),
             )
             logger.info(f"✅ Файл {filename} успешно загружен на сервер {host}")
         else:
             set_status(
-                server_id,
+                server.id,
+                remote_path,
                 filename,
                 file_size_byte,
                 FileStatus.RETRY.value,
-                "Ошибка при скачивании файла",
+                error_message="Ошибка при скачивании файла",
             )
             logger.error(f"❌ Не удалось загрузить файл {filename}")
             raise Exception("Ошибка при скачивании файла")
 
+    return result
+
+
+def defer_files(server_id: int, remote_path: str, files: list, retries: int = 0) -> None:
+    """Откладывает файлы, для которых не нашлось свободного слота передачи сервера"""
+    # Разброс задержки, чтобы отложенные задачи не возвращались одновременно
+    countdown = settings.TRANSFER_DEFER_DELAY * (1 + random.random())
+    if len(files) == 1:
+        download_file_task.apply_async(
+            kwargs={"server_id": server_id, "remote_path": remote_path, "file": files[0]},
+            countdown=countdown,
+            queue=download_queue(files[0][1]),
+            retries=retries,
+        )
+    else:
+        download_files_task.apply_async(
+            kwargs={"server_id": server_id, "remote_path": remote_path, "files": files},
+            countdown=countdown,
+            queue=download_queue(files[0][1]),
+        )
+
+
+@celery.task(bind=True, max_retries=10)
+def download_file_task(self, server_id: int, remote_path: str, file: list | dict, **legacy):
+    # Сообщения, поставленные в download_queue до перехода на ID сервера, содержат
+    # параметры подключения и файл словарем: параметры берутся по server_id
+    if isinstance(file, dict):
+        logger.debug(f"📨 Задача прежнего формата для {file['filename']}, поля {sorted(legacy)} не используются")
+        file = [file["filename"], file["st_size"], file["st_mtime"]]
+    descriptor, file = file, file_from_descriptor(file)
+    filename = file["filename"]
+    try:
+        return transfer_file(get_server(server_id), remote_path, file)
+    except DuplicateTransfer as e:
+        logger.info(f"⏭️ {str(e)}, задача пропущена")
+    except SlotUnavailable as e:
+        # Воркер не ждет слот: задача возвращается в очередь с задержкой
+        logger.info(f"⏳ {filename}: {str(e)}, задача отложена")
+        defer_files(server_id, remote_path, [descriptor], retries=self.request.retries)
     except Exception as e:
         logger.error(f"❌ Ошибка при скачивании {filename}: {str(e)}")
-        set_status(server_id, filename, file_size_byte, FileStatus.ERROR.value, str(e))
+        set_status(
+            server_id,
+            remote_path,
+            filename,
+            file["st_size"],
+            FileStatus.ERROR.value,
+            error_message=str(e),
+        )
         if self.request.retries < self.max_retries:
             logger.info(f"🔄 Повторная попытка для {filename}")
             raise self.retry(countdown=60, exc=e)
-    finally:
-        try:
-            sftp_service.disconnect()
-            logger.debug(f"🔌 Соединение с {host} закрыто после загрузки {filename}")
-        except Exception as disconnect_err:
-            logger.warning(f"⚠️ Проблема при закрытии соединения: {str(disconnect_err)}")
 
-    return result
+
+@celery.task(bind=True, max_retries=10)
+def download_files_task(self, server_id: int, remote_path: str, files: list):
+    """Скачивает пачку файлов одного сервера; сбойные файлы повторяются по одному"""
+    try:
+        server = get_server(server_id)
+    except Exception as e:
+        logger.error(f"❌ Не удалось получить параметры сервера {server_id}: {str(e)}")
+        raise self.retry(countdown=60, exc=e)
+
+    results = []
+    for i, descriptor in enumerate(files):
+        file = file_from_descriptor(descriptor)
+        try:
+            results.append(transfer_file(server, remote_path, file))
+        except DuplicateTransfer as e:
+            logger.info(f"⏭️ {str(e)}, файл пропущен")
+        except SlotUnavailable as e:
+            logger.info(f"⏳ {str(e)}, откладываем {len(files) - i} файлов из пачки")
+            defer_files(server_id, remote_path, files[i:])
+            break
+        except Exception as e:
+            logger.error(f"❌ Ошибка при скачивании {file['filename']}: {str(e)}")
+            set_status(
+                server_id,
+                remote_path,
+                file["filename"],
+                file["st_size"],
+                FileStatus.ERROR.value,
+                error_message=str(e),
+            )
+            logger.info(f"🔄 Повторная попытка для {file['filename']}")
+            download_file_task.apply_async(
+                kwargs={"server_id": server_id, "remote_path": remote_path, "file": descriptor},
+                countdown=60,
+                queue=download_queue(file["st_size"]),
+            )
+    return results
@@ -1,14 +1,21 @@
-import asyncio
+import math
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from loguru import logger
 from pydantic import BaseModel
 
-from ..celery_app import celery
+from ..celery_app import celery, download_queue, size_lane
+from ..config import settings
 from ..database import async_session_maker
 from ..manager.crud import ServerDAO
-from ..services.sftp import SFTPService
-from .download import download_file_task
+from ..services.dedup import file_dedup
+from ..services.metrics import SCAN_DURATION, STABILITY_WAIT, metrics_pipeline
+from ..services.scan_schedule import ScanLease, scan_schedule
+from ..services.sftp import sftp_pool
+from .crud import cache_servers, run_async
+from .download import download_file_task, download_files_task
 
 
 class ActiveServer(BaseModel):
@@ -30,110 +37,221 @@ def get_active_servers():
                 logger.error(f"❌ Ошибка при получении серверов из БД: {str(e)}")
                 return []
 
-        return asyncio.run(inner())
+        return run_async(inner())
     except Exception as e:
         logger.error(f"❌ Критическая ошибка при запуске асинхронной функции: {str(e)}")
         return []
 
 
-@celery.task()
-def scan_all_servers():
-    """Сканирует все активные серверы на наличие новых файлов"""
-    total_errors = 0
-    processed_servers = 0
-    processed_files = 0
+def split_patterns(patterns: str | None) -> list:
+    return [p.strip() for p in (patterns or "").split(",") if p.strip()]
 
-    logger.info("🚀 Запуск сканирования всех серверов")
 
-    # Получаем список активных серверов
-    servers = get_active_servers()
-    if not servers:
-        logger.info("ℹ️ Нет активных серверов для сканирования")
-        return {"status": "success", "message": "Нет активных серверов"}
+def dispatch_files(server_id: int, remote_path: str, files: list) -> int:
+    """Отправляет файлы директории пачками через одно соединение с брокером"""
+    # Версия файла, уже отправленная другим сканированием, повторно не отправляется
+    claimed = file_dedup.claim_many(server_id, remote_path, files)
+    if len(claimed) < len(files):
+        logger.info(f"⏭️ {len(files) - len(claimed)} файлов из {remote_path} уже отправлены ранее")
+    files = claimed
+    lanes = defaultdict(list)
+    with metrics_pipeline() as pipeline:
+        for file in files:
+            lane = size_lane(file.st_size)
+            lanes[lane].append([file.filename, file.st_size, file.st_mtime])
+            if hasattr(file, "stable_wait"):
+                STABILITY_WAIT.observe(file.stable_wait, pipeline, server=server_id, size=lane)
+
+    with celery.producer_or_acquire() as producer:
+        for lane, descriptors in lanes.items():
+            # Все файлы полосы попадают в одну очередь: она определяется по любому из них
+            queue = download_queue(descriptors[0][1])
+            # Крупные файлы отправляются по одному, чтобы их разбирали разные воркеры.
+            # Остальные — пачками не крупнее DISPATCH_BATCH_SIZE, но не меньше
+            # DISPATCH_FANOUT пачек, чтобы небольшой листинг распределился по воркерам
+            if lane == "large":
+                batch_size = 1
+            else:
+                batch_size = max(
+                    1,
+                    min(
+                        settings.DISPATCH_BATCH_SIZE,
+                        math.ceil(len(descriptors) / settings.DISPATCH_FANOUT),
+                    ),
+                )
+            for i in range(0, len(descriptors), batch_size):
+                batch = descriptors[i : i + batch_size]
+                if len(batch) == 1:
+                    download_file_task.apply_async(
+                        kwargs={"server_id": server_id, "remote_path": remote_path, "file": batch[0]},
+                        queue=queue,
+                        producer=producer,
+                    )
+                else:
+                    download_files_task.apply_async(
+                        kwargs={"server_id": server_id, "remote_path": remote_path, "files": batch},
+                        queue=queue,
+                        producer=producer,
+                    )
+    return len(files)
+
+
+def complete_scan(lease: ScanLease, server, result: dict) -> None:
+    """Планирует следующее сканирование сервера по результату текущего"""
+    # Сервер, на котором есть новые или растущие файлы, сканируется чаще;
+    # простаивающий или недоступный — все реже
+    active = not result["errors"] and (result["files"] or result["pending"])
+    try:
+        interval = lease.complete(server, active=bool(active))
+        logger.debug(f"🗓️ Следующее сканирование сервера {server.id} через {interval} сек")
+    except Exception as e:
+        logger.error(f"❌ Ошибка при планировании сканирования сервера {server.id}: {str(e)}")
 
-    logger.info(f"📊 Найдено {len(servers)} активных серверов для сканирования")
+
+def scan_server_group(connection_params: tuple, server_paths: list) -> dict:
+    """Сканирует все пути серверов, доступных по одним параметрам подключения.
+
+    Возвращает по ID сервера количество отправленных и еще не стабильных
+    файлов и ошибок сканирования. Следующее сканирование сервера планируется
+    здесь же, когда его сканирование действительно закончилось. Группа, не
+    успевшая к дедлайну, продолжает работу в фоне, а аренда ее еще не
+    просканированных серверов продлевается, так что повторно их не захватят.
+    """
+    with scan_schedule.hold([server_id for server_id, _, _ in server_paths]) as lease:
+        return _scan_server_group(lease, connection_params, server_paths)
+
+
+def _scan_server_group(lease: ScanLease, connection_params: tuple, server_paths: list) -> dict:
+    host, port, username, password = connection_params
+    results = {}
+    try:
+        with sftp_pool.lease(host, port, username, password) as sftp_service:
+            logger.info(f"🔌 Соединение с сервером {host} получено из пула")
+            for server_id, path, server in server_paths:
+                started = time.monotonic()
+                result = results[server_id] = {"files": 0, "pending": 0, "errors": 0}
+                sftp_service.pending_files = 0
+                try:
+                    if server.recursive:
+                        directories = sftp_service.scan_tree(
+                            path,
+                            max_depth=server.max_depth or settings.SCAN_MAX_DEPTH,
+                            include=split_patterns(server.include_patterns),
+                            exclude=split_patterns(server.exclude_patterns),
+                        )
+                    else:
+                        files = sftp_service.scan_directory(path)
+                        directories = [(path, files)] if files else []
+                    if not directories:
+                        logger.info(f"📂 Путь {path} не содержит новых файлов")
+                    for remote_path, files in directories:
+                        logger.info(f"📦 Обнаружено {len(files)} файлов в {remote_path}")
+                        try:
+                            result["files"] += dispatch_files(server_id, remote_path, files)
+                        except Exception as e:
+                            logger.error(
+                                f"❌ Ошибка при создании задач для файлов из {remote_path}: {str(e)}"
+                            )
+                            result["errors"] += 1
+                except Exception as e:
+                    logger.error(
+                        f"❌ Ошибка при сканировании пути {path} на сервере {host}: {str(e)}"
+                    )
+                    result["errors"] += 1
+                result["pending"] = sftp_service.pending_files
+                SCAN_DURATION.observe(time.monotonic() - started, server=server_id)
+                complete_scan(lease, server, result)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при работе с сервером {host}: {str(e)}")
+        for server_id, _, server in server_paths:
+            if server_id not in results:
+                results[server_id] = {"files": 0, "pending": 0, "errors": 1}
+                complete_scan(lease, server, results[server_id])
+    return results
+
+
+def scan_servers(servers: list) -> dict:
+    """Сканирует серверы и планирует их следующее сканирование"""
+    # Задачи скачивания получают параметры подключения из кеша по ID сервера
+    try:
+        cache_servers(servers)
+    except Exception as e:
+        logger.error(f"❌ Ошибка при кешировании параметров серверов: {str(e)}")
 
     # Группируем серверы по параметрам подключения
     union_servers = defaultdict(list)
     for server in servers:
-        connection_key = (
-            f"{server.host}:{server.port}:{server.username}:{server.password}"
-        )
-        union_servers[connection_key].append((server.id, server.path))
+        connection_key = (server.host, server.port, server.username, server.password)
+        union_servers[connection_key].append((server.id, server.path, server))
+
+    # Серверы сканируются параллельно: время сканирования определяется самым
+    # медленным доступным сервером, а недоступные отсекаются общим дедлайном
+    executor = ThreadPoolExecutor(max_workers=settings.SCAN_MAX_WORKERS)
+    futures = {
+        executor.submit(scan_server_group, connection_params, server_paths): connection_params[0]
+        for connection_params, server_paths in union_servers.items()
+    }
+    done, not_done = wait(futures, timeout=settings.SCAN_DEADLINE)
+    executor.shutdown(wait=False, cancel_futures=True)
 
-    for connection_params, server_paths in union_servers.items():
+    results = {}
+    for future in done:
         try:
-            host, port, username, password = connection_params.split(":")
-            sftp_service = SFTPService(
-                host=host,
-                port=int(port),
-                username=username,
-                password=password,
-            )
-            try:
-                sftp_service.connect()
-                logger.info(f"🔌 Подключение к серверу {host} установлено")
-                for server_id, path in server_paths:
-                    try:
-                        files = sftp_service.scan_directory(path)
-                        if files:
-                            logger.info(f"📦 Обнаружено {len(files)} файлов в {path}")
-                            for file in files:
-                                try:
-                                    download_file_task.apply_async(
-                                        kwargs={
-                                            "host": host,
-                                            "port": int(port),
-                                            "username": username,
-                                            "password": password,
-                                            "remote_path": path,
-                                            "file": sftp_service.sftp_attr_to_dict(
-                                                file
-                                            ),
-                                            "server_id": server_id,
-                                        },
-                                        queue="download_queue",
-                                    )
-                                    processed_files += 1
-                                except Exception as e:
-                                    logger.error(
-                                        f"❌ Ошибка при создании задачи для файла {file.filename}: {str(e)}"
-                                    )
-                                    total_errors += 1
-                        else:
-                            logger.info(f"📂 Путь {path} не содержит новых файлов")
-                    except Exception as e:
-                        logger.error(
-                            f"❌ Ошибка при сканировании пути {path} на сервере {host}: {str(e)}"
-                        )
-                        total_errors += 1
-                processed_servers += 1
-            except Exception as e:
-                logger.error(f"❌ Ошибка при работе с сервером {host}: {str(e)}")
-                total_errors += 1
-            finally:
-                try:
-                    sftp_service.disconnect()
-                except Exception as e:
-                    logger.warning(
-                        f"⚠️ Ошибка при отключении от сервера {host}: {str(e)}"
-                    )
-        except ValueError as e:
-            logger.error(f"❌ Некорректный формат параметров подключения: {str(e)}")
-            total_errors += 1
+            results.update(future.result())
         except Exception as e:
-            logger.error(f"❌ Непредвиденная ошибка при обработке сервера: {str(e)}")
-            total_errors += 1
+            logger.error(f"❌ Непредвиденная ошибка при обработке сервера {futures[future]}: {str(e)}")
+    for future in not_done:
+        logger.error(f"⏱️ Сервер {futures[future]} не просканирован за {settings.SCAN_DEADLINE} сек")
+
+    processed_servers = processed_files = total_errors = 0
+    for server in servers:
+        result = results.get(server.id, {"files": 0, "pending": 0, "errors": 1})
+        processed_servers += not result["errors"]
+        processed_files += result["files"]
+        total_errors += result["errors"]
+
     # Формируем отчет
     result = {
         "status": "success" if total_errors == 0 else "partial_success",
-        "servers_total": len(union_servers),
+        "servers_total": len(servers),
         "servers_processed": processed_servers,
         "files_processed": processed_files,
         "errors": total_errors,
     }
 
     logger.info(
-        f"✅ Сканирование завершено: обработано {processed_servers}/{len(union_servers)} серверов, {processed_files} файлов, {total_errors} ошибок"
+        f"✅ Сканирование завершено: обработано {processed_servers}/{len(servers)} серверов, {processed_files} файлов, {total_errors} ошибок"
     )
     return result
+
+
+@celery.task()
+def scan_all_servers():
+    """Сканирует все активные серверы на наличие новых файлов"""
+    logger.info("🚀 Запуск сканирования всех серверов")
+
+    # Получаем список активных серверов
+    servers = get_active_servers()
+    if not servers:
+        logger.info("ℹ️ Нет активных серверов для сканирования")
+        return {"status": "success", "message": "Нет активных серверов"}
+
+    logger.info(f"📊 Найдено {len(servers)} активных серверов для сканирования")
+    return scan_servers(servers)
+
+
+@celery.task()
+def scan_due_servers():
+    """Сканирует активные серверы, срок сканирования которых по расписанию наступил"""
+    servers = get_active_servers()
+    if not servers:
+        return {"status": "success", "message": "Нет активных серверов"}
+
+    # Захваченные серверы не возьмет воркер, выполняющий следующую проверку
+    due = set(scan_schedule.claim_due([server.id for server in servers]))
+    servers = [server for server in servers if server.id in due]
+    if not servers:
+        return {"status": "success", "message": "Нет серверов для сканирования"}
+
+    logger.info(f"🚀 Запуск сканирования {len(servers)} серверов по расписанию")
+    return scan_servers(servers)
@@ -0,0 +1,8 @@
+from ..celery_app import celery
+from ..services.staging import staging
+
+
+@celery.task()
+def sweep_staging():
+    """Удаляет из промежуточного каталога файлы и резервы, оставшиеся после упавших задач"""
+    return staging.sweep()
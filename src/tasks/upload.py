@@ -1,9 +1,48 @@
+import os
+import socket
+import time
+
 from loguru import logger
 
-from ..celery_app import celery
+from ..celery_app import celery, size_lane
+from ..config import settings
+from ..database import async_session_maker
+from ..manager.crud import FileDAO
 from ..manager.models import FileStatus
-from ..services.minio import MinioClient
-from .crud import set_status
+from ..services.metrics import UPLOAD_DURATION
+from ..services.minio import MinioClient, pool_stats
+from ..services.staging import staging
+from .crud import redis, run_async, set_status
+
+POOL_STATS_TTL = 300  # TTL (сек) метрик пула соединений процесса, который перестал отвечать
+
+
+def report_minio_pool() -> None:
+    """Публикует в Redis использование пула соединений MinIO текущего процесса"""
+    key = f"metrics:minio_pool:{socket.gethostname()}:{os.getpid()}"
+    try:
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.hset(key, mapping=pool_stats())
+        pipeline.expire(key, POOL_STATS_TTL)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сохранить метрики пула MinIO: {str(e)}")
+
+
+def find_duplicate(minio_service: MinioClient, checksum: str | None) -> str | None:
+    """Путь объекта с таким же содержимым, если он уже есть в MinIO"""
+    if settings.DEDUP_MODE == "off" or not checksum:
+        return None
+
+    async def inner():
+        async with async_session_maker() as session:
+            return await FileDAO().find_stored_by_checksum(session=session, checksum=checksum)
+
+    source = run_async(inner())
+    # Объект могли удалить из MinIO вручную — тогда файл загружается как обычно
+    if source and minio_service.object_exists(source):
+        return source
+    return None
 
 
 @celery.task(bind=True, max_retries=10)
@@ -15,23 +54,70 @@ def upload_file_to_minio(
     local_path: str,
     minio_path: str,
     bucket_name: str,
+    checksum: str | None = None,
+    etag: str | None = None,
+    # Задачи, поставленные до появления директории в ключе файла, относятся
+    # к строкам, у которых после миграции директория пустая
+    remote_path: str = "",
 ):
     try:
         minio_service = MinioClient()
+        source = find_duplicate(minio_service, checksum)
+        if source:
+            if settings.DEDUP_MODE == "copy":
+                minio_service.copy_object(bucket_name, minio_path, source)
+                stored_path = f"{bucket_name}/{minio_path}"
+            else:
+                stored_path = source
+            logger.info(f"♻️ Файл {filename} совпадает по содержимому с {source}, загрузка не нужна")
+            set_status(
+                server_id,
+                remote_path,
+                filename,
+                file_size_byte,
+                FileStatus.DOWNLOADED_TO_MINIO.value,
+                minio_path=stored_path,
+                checksum=checksum,
+                deduplicated=True,
+            )
+            staging.remove(local_path)
+            return
+        started = time.monotonic()
         minio_service.upload_file(
-            bucket_name=bucket_name, local_path=local_path, minio_path=minio_path
+            bucket_name=bucket_name,
+            local_path=local_path,
+            minio_path=minio_path,
+            checksum=checksum,
+            etag=etag,
+        )
+        UPLOAD_DURATION.observe(
+            time.monotonic() - started, server=server_id, size=size_lane(file_size_byte)
         )
         logger.info(f"✅ Файл {filename} успешно загружен в MinIO по пути {minio_path}")
         set_status(
             server_id,
+            remote_path,
             filename,
             file_size_byte,
             FileStatus.DOWNLOADED_TO_MINIO.value,
             minio_path=f"{bucket_name}/{minio_path}",
+            checksum=checksum,
+            deduplicated=False,
         )
+        # Файл в MinIO подтвержден, статус записан — локальная копия больше не нужна
+        staging.remove(local_path)
     except Exception as e:
         logger.error(f"❌ Ошибка при загрузке файла {filename} в MinIO: {str(e)}")
-        set_status(server_id, filename, file_size_byte, FileStatus.ERROR.value, str(e))
+        set_status(
+            server_id,
+            remote_path,
+            filename,
+            file_size_byte,
+            FileStatus.ERROR.value,
+            error_message=str(e),
+        )
         if self.request.retries < self.max_retries:
             logger.info(f"🔄 Повторная попытка для {filename}")
             raise self.retry(countdown=60, exc=e)
+    finally:
+        report_minio_pool()